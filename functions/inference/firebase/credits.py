@@ -5,7 +5,7 @@ All credit operations are atomic and idempotent.
 """
 from firebase_admin import firestore
 from google.cloud.firestore import transactional, SERVER_TIMESTAMP, Increment
-from typing import Tuple, Optional, Dict, Any
+from typing import Tuple, Optional, Dict, Any, Callable
 from datetime import datetime, timedelta
 import logging
 import math
@@ -44,6 +44,106 @@ def calculate_dubbing_cost(
     return max(1, math.ceil(base_credits * translation_mult * video_mult))
 
 
+def _run_credit_transaction(
+    update: Callable[..., Tuple[bool, Optional[str]]],
+    operation: str,
+    uid: str,
+    job_id: str,
+    collection_name: str,
+    *args: Any
+) -> Tuple[bool, Optional[str]]:
+    """
+    Run a credit transaction body for one user/job pair.
+    
+    `update` is called as update(transaction, user_ref, job_ref, uid, job_id, *args).
+    A ValueError it raises is a business failure and is returned as the
+    error message; any other exception is reported as a failed `operation`.
+    The transactional wrapper is built per call because it tracks retry
+    state and is not safe to share across threads.
+    """
+    db = firestore.client()
+    user_ref = db.collection("users").document(uid)
+    job_ref = db.collection(collection_name).document(job_id)
+    
+    try:
+        return transactional(update)(db.transaction(), user_ref, job_ref, uid, job_id, *args)
+    except ValueError as e:
+        logger.warning(f"Credit {operation} failed for {uid}: {str(e)}")
+        return False, str(e)
+    except Exception as e:
+        logger.error(f"Credit {operation} transaction failed: {str(e)}")
+        return False, f"Credit {operation} failed: {str(e)}"
+
+
+def _reserve_in_transaction(
+    transaction,
+    user_ref,
+    job_ref,
+    uid: str,
+    job_id: str,
+    cost: int,
+    job_data: Dict[str, Any]
+) -> Tuple[bool, Optional[str]]:
+    """Reserve credits and create the job document (transaction body)."""
+    # A missing document comes back as a snapshot with exists == False
+    job_snapshot = job_ref.get(field_paths=["uid"], transaction=transaction)
+    
+    # Check if job already exists (prevent double reservation)
+    if job_snapshot.exists:
+        raise ValueError("Job already exists - credits may already be reserved")
+    
+    # Get user document
+    user_snapshot = user_ref.get(transaction=transaction)
+    if not user_snapshot.exists:
+        raise ValueError("User document not found")
+    
+    user_data = user_snapshot.to_dict() or {}
+    is_pro = user_data.get("isPro", False)
+    total_credits = user_data.get("credits", 0)
+    pending_credits = user_data.get("pendingCredits", 0)
+    
+    # Calculate available credits
+    available_credits = total_credits - pending_credits
+    
+    # Pro users bypass credit check
+    if not is_pro and available_credits < cost:
+        raise ValueError(
+            f"Insufficient credits. Available: {available_credits}, Required: {cost}"
+        )
+    
+    # Reserve credits by incrementing pendingCredits (pro users have
+    # nothing to reserve, so their user document is left untouched)
+    if not is_pro:
+        transaction.update(user_ref, {
+            "pendingCredits": Increment(cost),
+            "updatedAt": SERVER_TIMESTAMP
+        })
+    
+    # Create job document with reservation flag
+    job_doc_data = {
+        "uid": uid,
+        "status": "queued",
+        "cost": cost,
+        "text": job_data.get("text", ""),
+        "isMultiCharacter": bool(job_data.get("character_texts")),
+        "wasPro": is_pro,
+        "pendingReserved": not is_pro,
+        "createdAt": SERVER_TIMESTAMP,
+        "updatedAt": SERVER_TIMESTAMP,
+        "pendingCreditExpiry": datetime.utcnow() + timedelta(hours=config.PENDING_CREDIT_TIMEOUT_HOURS),
+        "creditsReserved": True,
+        "creditsConfirmed": False,
+        # Written explicitly: the stale pending-credit cleanup filters on
+        # creditsReleased == False, which never matches a missing field
+        "creditsReleased": False,
+    }
+    
+    transaction.set(job_ref, job_doc_data)
+    
+    logger.info(f"Reserved {cost} credits for user {uid}, job {job_id}")
+    return True, None
+
+
 def reserve_credits(
     uid: str, 
     job_id: str, 
@@ -55,80 +155,87 @@ def reserve_credits(
     Atomically reserve credits and create job document.
     IMPROVED: Prevents race conditions and double reservations.
     """
-    db = firestore.client()
-    user_ref = db.collection("users").document(uid)
-    job_ref = db.collection(collection_name).document(job_id)
+    return _run_credit_transaction(
+        _reserve_in_transaction, "reservation", uid, job_id, collection_name, cost, job_data
+    )
+
+
+def _job_was_pro(job_data: Dict[str, Any], user_ref, transaction) -> bool:
+    """
+    Tier recorded on the job at reservation time. Jobs reserved before
+    wasPro was recorded fall back to reading the user document.
+    """
+    was_pro = job_data.get("wasPro")
+    if was_pro is not None:
+        return bool(was_pro)
     
-    @transactional
-    def update_in_transaction(transaction):
-        # FIXED: Properly get document snapshot in transaction
-        try:
-            job_snapshot = job_ref.get(transaction=transaction)
-        except Exception:
-            # If document doesn't exist, get() might fail in some Firestore versions
-            job_snapshot = None
-        
-        # Check if job already exists (prevent double reservation)
-        if job_snapshot and job_snapshot.exists:
-            raise ValueError("Job already exists - credits may already be reserved")
-        
-        # Get user document
-        user_snapshot = user_ref.get(transaction=transaction)
-        if not user_snapshot.exists:
-            raise ValueError("User document not found")
-        
-        user_data = user_snapshot.to_dict() or {}
-        is_pro = user_data.get("isPro", False)
-        total_credits = user_data.get("credits", 0)
-        pending_credits = user_data.get("pendingCredits", 0)
-        
-        # Calculate available credits
-        available_credits = total_credits - pending_credits
-        
-        # Pro users bypass credit check
-        if not is_pro and available_credits < cost:
-            raise ValueError(
-                f"Insufficient credits. Available: {available_credits}, Required: {cost}"
-            )
-        
-        # Reserve credits by incrementing pendingCredits
-        user_updates: Dict[str, Any] = {
-            "updatedAt": SERVER_TIMESTAMP
-        }
-        
-        if not is_pro:
-            user_updates["pendingCredits"] = Increment(cost)
-        
-        transaction.update(user_ref, user_updates)
-        
-        # Create job document with reservation flag
-        job_doc_data = {
-            "uid": uid,
-            "status": "queued",
-            "cost": cost,
-            "text": job_data.get("text", ""),
-            "isMultiCharacter": bool(job_data.get("character_texts")),
-            "createdAt": SERVER_TIMESTAMP,
-            "updatedAt": SERVER_TIMESTAMP,
-            "pendingCreditExpiry": datetime.utcnow() + timedelta(hours=config.PENDING_CREDIT_TIMEOUT_HOURS),
-            "creditsReserved": True,
-            "creditsConfirmed": False,
-        }
-        
-        transaction.set(job_ref, job_doc_data)
-        
-        logger.info(f"Reserved {cost} credits for user {uid}, job {job_id}")
+    user_snapshot = user_ref.get(field_paths=["isPro"], transaction=transaction)
+    if not user_snapshot.exists:
+        raise ValueError("User document not found")
+    return (user_snapshot.to_dict() or {}).get("isPro", False)
+
+
+def _job_pending_reserved(job_data: Dict[str, Any], is_pro: bool) -> bool:
+    """
+    Whether the reservation incremented the user's pendingCredits.
+    
+    The proxy reserves pendingCredits for every tier and this module only
+    for non-pro users, so the reserving side records it as pendingReserved.
+    Jobs reserved before the flag existed fall back to the tier.
+    """
+    pending_reserved = job_data.get("pendingReserved")
+    if pending_reserved is not None:
+        return bool(pending_reserved)
+    return not is_pro
+
+
+def _confirm_in_transaction(
+    transaction,
+    user_ref,
+    job_ref,
+    uid: str,
+    job_id: str,
+    cost: int
+) -> Tuple[bool, Optional[str]]:
+    """Move reserved credits into a real deduction (transaction body)."""
+    job_snapshot = job_ref.get(field_paths=["creditsConfirmed", "creditsReserved", "wasPro", "pendingReserved"], transaction=transaction)
+    if not job_snapshot.exists:
+        raise ValueError("Job document not found")
+    
+    job_data = job_snapshot.to_dict() or {}
+    if job_data.get("creditsConfirmed"):
+        logger.warning(f"Credits already confirmed for job {job_id}")
         return True, None
     
-    try:
-        transaction = db.transaction()
-        return update_in_transaction(transaction)
-    except ValueError as e:
-        logger.warning(f"Credit reservation failed for {uid}: {str(e)}")
-        return False, str(e)
-    except Exception as e:
-        logger.error(f"Credit reservation transaction failed: {str(e)}")
-        return False, f"Transaction failed: {str(e)}"
+    if not job_data.get("creditsReserved"):
+        raise ValueError("Credits were not reserved for this job")
+    
+    is_pro = _job_was_pro(job_data, user_ref, transaction)
+    
+    # Update user credits
+    updates = {
+        "totalVoicesGenerated": Increment(1),
+        "updatedAt": SERVER_TIMESTAMP
+    }
+    
+    if not is_pro:
+        # Deduct from actual credits
+        updates["credits"] = Increment(-cost)
+    
+    if _job_pending_reserved(job_data, is_pro):
+        # Remove from pending
+        updates["pendingCredits"] = Increment(-cost)
+    
+    transaction.update(user_ref, updates)
+    
+    # Mark credits as confirmed in job
+    transaction.update(job_ref, {
+        "creditsConfirmed": True,
+        "creditsConfirmedAt": SERVER_TIMESTAMP
+    })
+    
+    logger.info(f"Confirmed {cost} credit deduction for user {uid}, job {job_id}")
+    return True, None
 
 
 def confirm_credit_deduction(
@@ -141,64 +248,63 @@ def confirm_credit_deduction(
     Convert pending credits to actual deduction after successful generation.
     IMPROVED: Prevents double confirmation with idempotency check.
     """
-    db = firestore.client()
-    user_ref = db.collection("users").document(uid)
-    job_ref = db.collection(collection_name).document(job_id)
+    return _run_credit_transaction(
+        _confirm_in_transaction, "confirmation", uid, job_id, collection_name, cost
+    )
+
+
+def _release_in_transaction(
+    transaction,
+    user_ref,
+    job_ref,
+    uid: str,
+    job_id: str,
+    cost: int
+) -> Tuple[bool, Optional[str]]:
+    """Return reserved credits to the user (transaction body)."""
+    # A missing document comes back as a snapshot with exists == False
+    job_snapshot = job_ref.get(field_paths=["creditsConfirmed", "creditsReleased", "creditsReserved", "wasPro", "pendingReserved"], transaction=transaction)
     
-    @transactional
-    def update_in_transaction(transaction):
-        # FIXED: Properly get document snapshot in transaction
-        job_snapshot = job_ref.get(transaction=transaction)
-        if not job_snapshot.exists:
-            raise ValueError("Job document not found")
-        
-        job_data = job_snapshot.to_dict() or {}
-        if job_data.get("creditsConfirmed"):
-            logger.warning(f"Credits already confirmed for job {job_id}")
-            return True, None
-        
-        if not job_data.get("creditsReserved"):
-            raise ValueError("Credits were not reserved for this job")
-        
-        # Get user document
-        user_snapshot = user_ref.get(transaction=transaction)
-        if not user_snapshot.exists:
-            raise ValueError("User document not found")
-        
-        user_data = user_snapshot.to_dict() or {}
-        is_pro = user_data.get("isPro", False)
-        
-        # Update user credits
+    if not job_snapshot.exists:
+        logger.warning(f"Job {job_id} not found, skipping credit release")
+        return True, None
+    
+    job_data = job_snapshot.to_dict() or {}
+    
+    # If credits already confirmed, don't release
+    if job_data.get("creditsConfirmed"):
+        logger.warning(f"Credits already confirmed for job {job_id}, cannot release")
+        return False, "Credits already confirmed"
+    
+    # If credits already released, skip (idempotency)
+    if job_data.get("creditsReleased"):
+        logger.info(f"Credits already released for job {job_id}")
+        return True, None
+    
+    if not job_data.get("creditsReserved"):
+        logger.warning(f"Credits were not reserved for job {job_id}")
+        return True, None
+    
+    # Release credits (the tier is only needed for jobs without pendingReserved)
+    pending_reserved = job_data.get("pendingReserved")
+    if pending_reserved is None:
+        pending_reserved = not _job_was_pro(job_data, user_ref, transaction)
+    
+    if pending_reserved:
         updates = {
-            "totalVoicesGenerated": Increment(1),
+            "pendingCredits": Increment(-cost),
             "updatedAt": SERVER_TIMESTAMP
         }
-        
-        if not is_pro:
-            # Deduct from actual credits and remove from pending
-            updates["credits"] = Increment(-cost)
-            updates["pendingCredits"] = Increment(-cost)
-        
         transaction.update(user_ref, updates)
-        
-        # Mark credits as confirmed in job
-        transaction.update(job_ref, {
-            "creditsConfirmed": True,
-            "creditsConfirmedAt": SERVER_TIMESTAMP
-        })
-        
-        logger.info(f"Confirmed {cost} credit deduction for user {uid}, job {job_id}")
-        return True, None
     
-    try:
-        transaction = db.transaction()
-        return update_in_transaction(transaction)
-    except ValueError as e:
-        logger.warning(f"Credit confirmation failed for {uid}: {str(e)}")
-        return False, str(e)
-    except Exception as e:
-        logger.error(f"Credit confirmation transaction failed: {str(e)}")
-        return False, f"Credit confirmation failed: {str(e)}"
+    # Mark credits as released in job
+    transaction.update(job_ref, {
+        "creditsReleased": True,
+        "creditsReleasedAt": SERVER_TIMESTAMP
+    })
+    
+    logger.info(f"Released {cost} credits for user {uid}, job {job_id}")
+    return True, None
 
 
 def release_credits(
@@ -211,72 +317,9 @@ def release_credits(
     Release reserved credits when generation fails.
     IMPROVED: Idempotent - safe to call multiple times.
     """
-    db = firestore.client()
-    user_ref = db.collection("users").document(uid)
-    job_ref = db.collection(collection_name).document(job_id)
-    
-    @transactional
-    def update_in_transaction(transaction):
-        # FIXED: Properly get document snapshot in transaction
-        try:
-            job_snapshot = job_ref.get(transaction=transaction)
-        except Exception:
-            job_snapshot = None
-        
-        if not job_snapshot or not job_snapshot.exists:
-            logger.warning(f"Job {job_id} not found, skipping credit release")
-            return True, None
-        
-        job_data = job_snapshot.to_dict() or {}
-        
-        # If credits already confirmed, don't release
-        if job_data.get("creditsConfirmed"):
-            logger.warning(f"Credits already confirmed for job {job_id}, cannot release")
-            return False, "Credits already confirmed"
-        
-        # If credits already released, skip (idempotency)
-        if job_data.get("creditsReleased"):
-            logger.info(f"Credits already released for job {job_id}")
-            return True, None
-        
-        if not job_data.get("creditsReserved"):
-            logger.warning(f"Credits were not reserved for job {job_id}")
-            return True, None
-        
-        # Get user document
-        user_snapshot = user_ref.get(transaction=transaction)
-        if not user_snapshot.exists:
-            raise ValueError("User document not found")
-        
-        user_data = user_snapshot.to_dict() or {}
-        is_pro = user_data.get("isPro", False)
-        
-        # Release credits
-        if not is_pro:
-            updates = {
-                "pendingCredits": Increment(-cost),
-                "updatedAt": SERVER_TIMESTAMP
-            }
-            transaction.update(user_ref, updates)
-        
-        # Mark credits as released in job
-        transaction.update(job_ref, {
-            "creditsReleased": True,
-            "creditsReleasedAt": SERVER_TIMESTAMP
-        })
-        
-        logger.info(f"Released {cost} credits for user {uid}, job {job_id}")
-        return True, None
-    
-    try:
-        transaction = db.transaction()
-        return update_in_transaction(transaction)
-    except ValueError as e:
-        logger.warning(f"Credit release failed for {uid}: {str(e)}")
-        return False, str(e)
-    except Exception as e:
-        logger.error(f"Credit release transaction failed: {str(e)}")
-        return False, f"Credit release failed: {str(e)}"
+    return _run_credit_transaction(
+        _release_in_transaction, "release", uid, job_id, collection_name, cost
+    )
 
 
 def check_credits_available(uid: str, cost: int = 1) -> Tuple[bool, Optional[str]]:
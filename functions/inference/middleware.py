@@ -7,16 +7,24 @@ import secrets
 import logging
 import traceback
 from functools import wraps
-from typing import Callable, Optional, Tuple, Any
+from typing import Callable, Optional, Tuple, Any, Dict, List
 from flask import request, abort, jsonify, g, Request
-from google.cloud.firestore import SERVER_TIMESTAMP
+from google.cloud.firestore import SERVER_TIMESTAMP, DELETE_FIELD
 from config import config
+from firebase.credits import release_credits as release_credits_func
 from firebase_admin import firestore
 
 
 logger = logging.getLogger(__name__)
 _db = None
 
+# Dubbing chunks live in dubbingJobs/{jobId}/chunks/{chunkId}, so workers
+# update their own small document instead of rewriting an array on the job
+DUBBING_CHUNKS_COLLECTION = "chunks"
+
+# Firestore rejects batches with more writes than this
+FIRESTORE_BATCH_LIMIT = 500
+
 # Explicitly export public functions for type checkers
 __all__ = [
     'get_db',
@@ -30,6 +38,10 @@ __all__ = [
     'update_job_status',
     'get_retry_info',
     'update_job_retry_status',
+    'get_dubbing_chunk_ref',
+    'write_dubbing_chunks',
+    'get_dubbing_chunks',
+    'get_legacy_dubbing_chunks',
 ]
 
 def get_db():
@@ -149,8 +161,6 @@ def handle_job_errors(collection: str = "voiceJobs", release_credits: bool = Tru
                 # Release credits if needed
                 if release_credits and uid and job_id:
                     try:
-                        from firebase.credits import release_credits as release_credits_func
-                        
                         job_ref = get_db().collection(collection).document(job_id)
                         job_doc = job_ref.get()
                         
@@ -350,4 +360,73 @@ def update_job_retry_status(
             "maxRetries": max_retries,
             "nextRetryAttempt": retry_count + 1,
             "updatedAt": SERVER_TIMESTAMP
-        })
\ No newline at end of file
+        })
+
+
+def get_dubbing_chunk_ref(job_ref, chunk_id: int):
+    """Get the document reference for one chunk of a dubbing job."""
+    return job_ref.collection(DUBBING_CHUNKS_COLLECTION).document(str(chunk_id))
+
+
+def write_dubbing_chunks(job_ref, chunks: List[Dict[str, Any]], job_updates: Dict[str, Any]) -> None:
+    """
+    Write a dubbing job's chunk documents and update the job.
+    
+    Chunks are written with batched sets; the job update rides in the last
+    batch, so for up to FIRESTORE_BATCH_LIMIT - 1 chunks everything commits
+    in a single write. totalChunks and completedChunks are reset from the
+    chunk list and any legacy inline clonedAudioChunks array is removed.
+    
+    Args:
+        job_ref: Dubbing job document reference
+        chunks: Chunk documents, each with a chunkId
+        job_updates: Fields to update on the job document
+    """
+    db = get_db()
+    batch = db.batch()
+    writes = 0
+    
+    for chunk in chunks:
+        if writes == FIRESTORE_BATCH_LIMIT - 1:
+            batch.commit()
+            batch = db.batch()
+            writes = 0
+        batch.set(get_dubbing_chunk_ref(job_ref, chunk["chunkId"]), chunk)
+        writes += 1
+    
+    batch.update(job_ref, {
+        **job_updates,
+        "totalChunks": len(chunks),
+        "completedChunks": 0,
+        "clonedAudioChunks": DELETE_FIELD
+    })
+    batch.commit()
+
+
+def get_dubbing_chunks(job_ref, total_chunks: int) -> List[Dict[str, Any]]:
+    """
+    Read a dubbing job's chunk documents, ordered by chunkId.
+    
+    Documents left over from an earlier, longer run are ignored.
+    """
+    chunks = [
+        chunk for chunk in (
+            doc.to_dict() or {}
+            for doc in job_ref.collection(DUBBING_CHUNKS_COLLECTION).stream()
+        )
+        if chunk.get("chunkId", total_chunks) < total_chunks
+    ]
+    chunks.sort(key=lambda c: c["chunkId"])
+    return chunks
+
+
+def get_legacy_dubbing_chunks(job_data: Dict[str, Any]) -> Optional[List[Dict[str, Any]]]:
+    """
+    Get the inline clonedAudioChunks array of a job cloned before chunks
+    moved to the chunks subcollection, or None for current jobs.
+    
+    Writers of the chunk documents delete the array, so its presence marks
+    a job that is still on the legacy layout.
+    """
+    legacy_chunks = job_data.get("clonedAudioChunks")
+    return legacy_chunks if isinstance(legacy_chunks, list) else None
@@ -4,6 +4,7 @@ import os
 from firebase_admin import firestore
 
 from config import config
+from firebase.credits import release_credits
 from utils.cleanup import temp_file, TempFileManager
 from utils.gcs_utils import download_to_file, upload_file_to_gcs
 from utils.speaker_clustering import cluster_speakers_embeddings, generate_speaker_sample
@@ -170,7 +171,6 @@ def cluster_speakers_route():
         
         if is_final_attempt:
             update_job_retry_status(job_ref, retry_count, error_msg, True)
-            from firebase.credits import release_credits
             release_credits(uid, job_id, job_data.get("cost", 0), collection_name="dubbingJobs")
             return {"error": error_msg}, 500
         else:
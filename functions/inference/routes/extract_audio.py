@@ -4,13 +4,14 @@ Audio extraction route with improved error handling and resource cleanup.
 Extracts audio from video and starts Google STT transcription.
 """
 import logging
+import os
 from pathlib import Path
 from google.cloud import speech_v1 as speech, tasks_v2
 from firebase_admin import firestore
-import base64
-import json
 
 from config import config
+from firebase.credits import release_credits
+from utils.task_utils import TASK_HEADERS, create_tasks, encode_task_body
 from utils.cleanup import temp_file
 from utils.gcs_utils import download_to_file, upload_file_to_gcs, generate_signed_url
 from utils.audio_processor import extract_audio_from_video
@@ -114,7 +115,6 @@ def extract_audio_route():
                     )
                 finally:
                     # Clean up the temporary file created by extract_audio_from_video
-                    import os
                     if os.path.exists(audio_file_path):
                         os.remove(audio_file_path)
             else:
@@ -282,13 +282,6 @@ def extract_audio_route():
         logger.info(f"Job {job_id}: Transcription complete, {len(merged_transcript)} segments")
         
         # Queue speaker clustering task
-        tasks_client = tasks_v2.CloudTasksClient()
-        queue_path = tasks_client.queue_path(
-            config.GCP_PROJECT,
-            config.QUEUE_LOCATION,
-            config.QUEUE_NAME
-        )
-        
         task_payload = {
             "job_id": job_id,
             "uid": uid,
@@ -306,11 +299,8 @@ def extract_audio_route():
             "http_request": {
                 "http_method": tasks_v2.HttpMethod.POST,
                 "url": f"{cloud_run_url}/cluster-speakers",
-                "headers": {
-                    "Content-Type": "application/json",
-                    "X-Internal-Token": config.INTERNAL_TOKEN,
-                },
-                "body": base64.b64encode(json.dumps(task_payload).encode()).decode(),
+                "headers": TASK_HEADERS,
+                "body": encode_task_body(task_payload),
             },
             "dispatch_deadline": {"seconds": config.TASK_DEADLINE},
         }
@@ -320,7 +310,7 @@ def extract_audio_route():
                 "service_account_email": config.SERVICE_ACCOUNT_EMAIL
             }
         
-        tasks_client.create_task(request={"parent": queue_path, "task": task})
+        create_tasks([task])
         
         logger.info(f"Job {job_id}: Queued speaker clustering")
         
@@ -332,7 +322,6 @@ def extract_audio_route():
         
         if is_final_attempt:
             update_job_retry_status(job_ref, retry_count, error_msg, True)
-            from firebase.credits import release_credits
             release_credits(uid, job_id, job_data.get("cost", 0), collection_name="dubbingJobs")
             return {"error": error_msg}, 500
         else:
@@ -2,26 +2,28 @@
 Production-ready inference route with comprehensive improvements.
 """
 import logging
+import threading
 import time
 import datetime
 import torch
 import numpy as np
 import requests
-import json
-import base64
+from requests.adapters import HTTPAdapter
 from io import BytesIO
-from typing import Optional
+from typing import Dict, Optional, Set, Tuple
 from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 
 from google.cloud import tasks_v2
 import soundfile as sf
 from flask import request, jsonify, g
 from firebase_admin import firestore, storage
-from google.cloud.firestore import SERVER_TIMESTAMP, Increment
+from google.cloud.firestore import transactional, SERVER_TIMESTAMP, Increment
 from pydantic import ValidationError
 
 from config import config
-from utils.validators import validate_request, InferenceRequest
+from utils.task_utils import TASK_HEADERS, create_tasks, encode_task_body
+from utils.validators import validate_request_json, InferenceRequest, PayloadTooLargeError
 from utils.gcs_utils import upload_to_gcs, merge_audio_chunks_from_gcs, generate_signed_url
 from utils import (
     detect_multi_speaker,
@@ -33,7 +35,14 @@ from firebase.credits import (
     confirm_credit_deduction,
     release_credits
 )
-from middleware import update_job_status, get_retry_info, update_job_retry_status
+from middleware import (
+    update_job_status,
+    get_retry_info,
+    update_job_retry_status,
+    get_dubbing_chunk_ref,
+    get_dubbing_chunks,
+    get_legacy_dubbing_chunks
+)
 
 logger = logging.getLogger(__name__)
 db = firestore.client()
@@ -43,6 +52,46 @@ DOWNLOAD_TIMEOUT = 30
 MAX_TEXT_LENGTH = 10000
 MAX_AUDIO_DURATION = 300  # 5 minutes
 
+# Shared HTTP session for sample downloads, so keep-alive connections (and
+# their TLS handshakes) are reused across jobs on a warm instance
+HTTP_POOL_CONNECTIONS = 4
+HTTP_POOL_MAXSIZE = 16
+_http_session = requests.Session()
+_http_session.mount("https://", HTTPAdapter(
+    pool_connections=HTTP_POOL_CONNECTIONS,
+    pool_maxsize=HTTP_POOL_MAXSIZE,
+    max_retries=0
+))
+
+# merge-video tasks also carry the token as a bearer header (redundancy)
+_MERGE_VIDEO_TASK_HEADERS = {
+    **TASK_HEADERS,
+    "Authorization": f"Bearer {config.INTERNAL_TOKEN}",
+}
+
+# Character fields needed to locate a voice sample
+CHARACTER_SAMPLE_FIELDS = ["sampleAudioUrl", "sampleAudioStoragePath"]
+
+# Sample fields per character are cached on the instance (characters are
+# shared across jobs and their samples rarely change)
+CHARACTER_CACHE_TTL_SECONDS = 300
+CHARACTER_CACHE_MAX_ENTRIES = 1024
+_character_cache: Dict[str, Tuple[float, dict]] = {}
+_character_cache_lock = threading.Lock()
+
+# Voice samples for a job are fetched concurrently over the pooled session
+SAMPLE_DOWNLOAD_MAX_WORKERS = 4
+_sample_download_executor = ThreadPoolExecutor(
+    max_workers=SAMPLE_DOWNLOAD_MAX_WORKERS,
+    thread_name_prefix="sample-download"
+)
+
+# Credit confirmation runs here while the completing request signs its URL
+_credit_confirm_executor = ThreadPoolExecutor(
+    max_workers=2,
+    thread_name_prefix="credit-confirm"
+)
+
 
 @contextmanager
 def gpu_memory_cleanup():
@@ -86,12 +135,14 @@ def increment_voice_counts(uid: str, character_id: Optional[str]):
 
 
 
-def download_voice_sample_from_firebase(character_id: str) -> bytes:
+def download_voice_sample_from_firebase(character_id: str, char_data: Optional[dict] = None) -> bytes:
     """
     Download voice sample from Firebase Storage with retry logic.
     
     Args:
         character_id: Character document ID
+        char_data: Character document data if already fetched (the document
+            is read when omitted)
         
     Returns:
         Audio bytes
@@ -101,12 +152,14 @@ def download_voice_sample_from_firebase(character_id: str) -> bytes:
     """
     try:
         # Get character document
-        char_doc = db.collection("characters").document(character_id).get()
-        
-        if not char_doc.exists:
-            raise Exception(f"Character {character_id} not found")
+        if char_data is None:
+            char_doc = db.collection("characters").document(character_id).get(field_paths=CHARACTER_SAMPLE_FIELDS)
+            
+            if not char_doc.exists:
+                raise Exception(f"Character {character_id} not found")
+            
+            char_data = char_doc.to_dict()
         
-        char_data = char_doc.to_dict()
         if not char_data:
             raise Exception(f"Character {character_id} has no data")
         
@@ -120,7 +173,7 @@ def download_voice_sample_from_firebase(character_id: str) -> bytes:
         if sample_url and sample_url.startswith("http"):
             for attempt in range(2):  # 2 attempts
                 try:
-                    response = requests.get(sample_url, timeout=DOWNLOAD_TIMEOUT)
+                    response = _http_session.get(sample_url, timeout=DOWNLOAD_TIMEOUT)
                     if response.status_code == 200:
                         return response.content
                 except requests.RequestException as e:
@@ -145,23 +198,36 @@ def download_voice_sample_from_firebase(character_id: str) -> bytes:
         raise
 
 
-def download_original_speaker_sample(job_id: str, speaker_id: str, job_type: str) -> bytes:
-    """Download original speaker voice sample from job data."""
+def get_speaker_voice_samples(job_id: str, job_type: str) -> dict:
+    """Read a job's speaker ID -> sample URL map (speakerVoiceSamples)."""
+    if job_type == "dubbing":
+        job_ref = db.collection("dubbingJobs").document(job_id)
+    else:
+        job_ref = db.collection("voiceJobs").document(job_id)
+    
+    job_doc = job_ref.get(field_paths=["speakerVoiceSamples"])
+    if not job_doc.exists:
+        raise Exception(f"Job {job_id} not found")
+    
+    return (job_doc.to_dict() or {}).get("speakerVoiceSamples") or {}
+
+
+def download_original_speaker_sample(
+    job_id: str,
+    speaker_id: str,
+    job_type: str,
+    speaker_samples: Optional[dict] = None
+) -> bytes:
+    """
+    Download original speaker voice sample from job data.
+    
+    speaker_samples is the job's speakerVoiceSamples map if already fetched
+    (the job is read when omitted).
+    """
     try:
-        if job_type == "dubbing":
-            job_ref = db.collection("dubbingJobs").document(job_id)
-        else:
-            job_ref = db.collection("voiceJobs").document(job_id)
+        if speaker_samples is None:
+            speaker_samples = get_speaker_voice_samples(job_id, job_type)
         
-        job_doc = job_ref.get()
-        if not job_doc.exists:
-            raise Exception(f"Job {job_id} not found")
-        
-        job_data = job_doc.to_dict()
-        if not job_data:
-            raise Exception(f"Job {job_id} is empty")
-            
-        speaker_samples = job_data.get("speakerVoiceSamples", {})
         sample_url = speaker_samples.get(speaker_id)
         
         if not sample_url:
@@ -178,7 +244,7 @@ def download_original_speaker_sample(job_id: str, speaker_id: str, job_type: str
             return blob.download_as_bytes()
         
         elif sample_url.startswith("http"):
-            response = requests.get(sample_url, timeout=DOWNLOAD_TIMEOUT)
+            response = _http_session.get(sample_url, timeout=DOWNLOAD_TIMEOUT)
             if response.status_code == 200:
                 return response.content
         
@@ -189,6 +255,52 @@ def download_original_speaker_sample(job_id: str, speaker_id: str, job_type: str
         raise
 
 
+def get_character_sample_data(character_ids: Set[str]) -> Dict[str, dict]:
+    """
+    Get the sample fields of several characters, keyed by character ID.
+    
+    Entries cached by this instance within CHARACTER_CACHE_TTL_SECONDS are
+    reused; the rest are read with one batched get_all. Characters that do
+    not exist are left out.
+    """
+    now = time.monotonic()
+    char_data_by_id = {}
+    
+    with _character_cache_lock:
+        for char_id in character_ids:
+            entry = _character_cache.get(char_id)
+            if entry is not None and now - entry[0] < CHARACTER_CACHE_TTL_SECONDS:
+                char_data_by_id[char_id] = entry[1]
+    
+    missing_ids = [char_id for char_id in character_ids if char_id not in char_data_by_id]
+    if not missing_ids:
+        return char_data_by_id
+    
+    char_refs = [db.collection("characters").document(char_id) for char_id in missing_ids]
+    fetched = {
+        char_doc.id: char_doc.to_dict() or {}
+        for char_doc in db.get_all(char_refs, field_paths=CHARACTER_SAMPLE_FIELDS)
+        if char_doc.exists
+    }
+    
+    with _character_cache_lock:
+        if len(_character_cache) + len(fetched) > CHARACTER_CACHE_MAX_ENTRIES:
+            # Drop expired entries first; start over if that is not enough
+            expired_ids = [
+                char_id for char_id, (cached_at, _) in _character_cache.items()
+                if now - cached_at >= CHARACTER_CACHE_TTL_SECONDS
+            ]
+            for char_id in expired_ids:
+                del _character_cache[char_id]
+            if len(_character_cache) + len(fetched) > CHARACTER_CACHE_MAX_ENTRIES:
+                _character_cache.clear()
+        for char_id, char_data in fetched.items():
+            _character_cache[char_id] = (now, char_data)
+    
+    char_data_by_id.update(fetched)
+    return char_data_by_id
+
+
 def fetch_voice_samples_from_character_ids(
     character_ids: list[str],
     job_id: Optional[str] = None,
@@ -208,13 +320,19 @@ def fetch_voice_samples_from_character_ids(
     if not character_ids:
         raise ValueError("No character IDs provided")
     
-    voice_samples = []
+    # Look up every referenced character document in one batched read, and
+    # the job's original speaker samples once, before the downloads start
+    regular_ids = {
+        char_id for char_id in character_ids
+        if isinstance(char_id, str) and not char_id.startswith("original:")
+    }
+    char_data_by_id = get_character_sample_data(regular_ids)
     
-    for idx, char_id in enumerate(character_ids):
-        if char_id is None:
-            logger.warning(f"Skipping None character ID at index {idx}")
-            continue
-        
+    speaker_samples = None
+    if job_id and any(isinstance(char_id, str) and char_id.startswith("original:") for char_id in character_ids):
+        speaker_samples = get_speaker_voice_samples(job_id, job_type)
+    
+    def fetch_sample(idx: int, char_id: str) -> bytes:
         try:
             # Handle original speaker samples
             if isinstance(char_id, str) and char_id.startswith("original:"):
@@ -222,17 +340,32 @@ def fetch_voice_samples_from_character_ids(
                     raise ValueError("Job ID is required for original speaker samples")
                 
                 speaker_id = char_id.split(":", 1)[1]
-                audio_bytes = download_original_speaker_sample(job_id, speaker_id, job_type)
-                voice_samples.append(audio_bytes)
-            else:
-                # Regular character
-                audio_bytes = download_voice_sample_from_firebase(char_id)
-                voice_samples.append(audio_bytes)
+                return download_original_speaker_sample(job_id, speaker_id, job_type, speaker_samples)
+            
+            # Regular character
+            if char_id not in char_data_by_id:
+                raise Exception(f"Character {char_id} not found")
+            return download_voice_sample_from_firebase(char_id, char_data_by_id[char_id])
         
         except Exception as e:
             logger.error(f"Failed to download sample for {char_id} (index {idx}): {str(e)}")
             raise Exception(f"Failed to load voice sample {idx + 1}: {str(e)}")
     
+    indices = []
+    for idx, char_id in enumerate(character_ids):
+        if char_id is None:
+            logger.warning(f"Skipping None character ID at index {idx}")
+            continue
+        indices.append(idx)
+    
+    # Results keep the order of character_ids; the first failure is raised
+    if len(indices) == 1:
+        voice_samples = [fetch_sample(indices[0], character_ids[indices[0]])]
+    else:
+        voice_samples = list(_sample_download_executor.map(
+            fetch_sample, indices, [character_ids[idx] for idx in indices]
+        ))
+    
     if not voice_samples:
         raise ValueError("No voice samples could be downloaded")
     
@@ -265,10 +398,15 @@ def inference_route(processor, model):
     
     # Validate request
     try:
-        req = validate_request(InferenceRequest, request.get_json(silent=True) or {})
+        req = validate_request_json(InferenceRequest, request.get_data())
+    except PayloadTooLargeError as e:
+        logger.warning(f"Rejected request: {str(e)}")
+        return jsonify({"error": "Payload too large"}), 413
     except ValidationError as e:
-        logger.warning(f"Invalid request: {e.errors()}")
-        return jsonify({"error": "Invalid request", "details": e.errors()}), 400
+        # Raw-body errors carry the offending bytes as input, which isn't JSON-serializable
+        details = e.errors(include_url=False, include_input=False)
+        logger.warning(f"Invalid request: {details}")
+        return jsonify({"error": "Invalid request", "details": details}), 400
     
     job_id = req.job_id
     uid = req.uid
@@ -328,19 +466,24 @@ def inference_route(processor, model):
             reserved_cost = job_data.get("cost", 0)
         
         else:  # dubbing job
-            cloned_chunks = job_data.get("clonedAudioChunks", [])
-            chunk_data = None
-            for chunk in cloned_chunks:
-                if chunk["chunkId"] == chunk_id:
-                    chunk_data = chunk
-                    break
+            # Jobs cloned before chunks moved to the subcollection keep
+            # them in the inline clonedAudioChunks array
+            legacy_chunks = get_legacy_dubbing_chunks(job_data)
+            if legacy_chunks is not None:
+                chunk_ref = None
+                chunk_data = next((c for c in legacy_chunks if c.get("chunkId") == chunk_id), None)
+                total_chunks = len(legacy_chunks)
+            else:
+                chunk_ref = get_dubbing_chunk_ref(job_ref, chunk_id)
+                chunk_doc = chunk_ref.get()
+                chunk_data = chunk_doc.to_dict() if chunk_doc.exists else None
+                total_chunks = job_data.get("totalChunks", 0)
             
             if not chunk_data:
                 return jsonify({"error": "Chunk not found"}), 404
             
             text = chunk_data.get("text")
             character_ids = chunk_data.get("characterIds", [])
-            total_chunks = len(cloned_chunks)
             reserved_cost = job_data.get("cost", 0)
         
         # Validate inputs
@@ -387,17 +530,19 @@ def inference_route(processor, model):
                 if is_retry:
                     update_data["retryCount"] = retry_count
                 job_ref.update(update_data)
-        else:
-            cloned_chunks = job_data.get("clonedAudioChunks", [])
-            for chunk in cloned_chunks:
-                if chunk["chunkId"] == chunk_id:
-                    chunk["status"] = "processing"
-                    if is_retry:
-                        chunk["retryCount"] = retry_count
+        elif chunk_ref is None:
+            chunk_data["status"] = "processing"
+            if is_retry:
+                chunk_data["retryCount"] = retry_count
             job_ref.update({
-                "clonedAudioChunks": cloned_chunks,
+                "clonedAudioChunks": legacy_chunks,
                 "updatedAt": SERVER_TIMESTAMP
             })
+        else:
+            chunk_update = {"status": "processing", "updatedAt": SERVER_TIMESTAMP}
+            if is_retry:
+                chunk_update["retryCount"] = retry_count
+            chunk_ref.update(chunk_update)
         
         # Format text for model
         final_text = text
@@ -464,7 +609,7 @@ def inference_route(processor, model):
         # Save to buffer
         buffer = BytesIO()
         sf.write(buffer, audio_np, config.SAMPLE_RATE, format="WAV")
-        audio_bytes = buffer.getvalue()
+        audio_size = buffer.getbuffer().nbytes
         
         # Upload to GCS
         upload_start = time.time()
@@ -478,7 +623,7 @@ def inference_route(processor, model):
             else:
                 blob_name = f"jobs/{job_id}/output.wav"
         
-        upload_to_gcs(gcs_bucket, blob_name, audio_bytes, content_type="audio/wav")
+        upload_to_gcs(gcs_bucket, blob_name, buffer, content_type="audio/wav")
         chunk_url = f"gs://{gcs_bucket}/{blob_name}"
         upload_time = time.time() - upload_start
         
@@ -515,7 +660,7 @@ def inference_route(processor, model):
                 job_id,
                 uid,
                 blob_name,
-                audio_bytes,
+                audio_size,
                 audio_duration,
                 total_time,
                 reserved_cost,
@@ -566,6 +711,33 @@ def inference_route(processor, model):
             return jsonify({"error": "Retrying", "retry": retry_count}), 500
 
 
+@transactional
+def _complete_dubbing_chunk(transaction, job_ref, chunk_ref, chunk_updates: dict) -> int:
+    """
+    Mark a dubbing chunk completed and count it on the job.
+    
+    The chunk and the job counter change in one transaction, so concurrent
+    chunk workers cannot lose each other's updates and a redelivered task
+    does not count its chunk twice.
+    
+    Returns:
+        The job's completed chunk count
+    """
+    chunk_snapshot = chunk_ref.get(field_paths=["status"], transaction=transaction)
+    job_snapshot = job_ref.get(field_paths=["completedChunks"], transaction=transaction)
+    completed_chunks = (job_snapshot.to_dict() or {}).get("completedChunks", 0)
+    
+    if (chunk_snapshot.to_dict() or {}).get("status") != "completed":
+        completed_chunks += 1
+        transaction.update(job_ref, {
+            "completedChunks": completed_chunks,
+            "updatedAt": SERVER_TIMESTAMP
+        })
+    
+    transaction.update(chunk_ref, chunk_updates)
+    return completed_chunks
+
+
 def _handle_multi_chunk_completion(
     job_ref,
     job_id: str,
@@ -586,6 +758,7 @@ def _handle_multi_chunk_completion(
     # Initialize variables to avoid unbound warnings
     chunks = []
     cloned_chunks = []
+    chunk_urls = []
     
     if job_type == "voice":
         chunks = job_data.get("chunks", [])
@@ -604,8 +777,9 @@ def _handle_multi_chunk_completion(
         chunk_urls = [c["audioUrl"] for c in chunks if c.get("audioUrl")]
         gcs_bucket = config.GCS_BUCKET
         
-    else:  # dubbing
-        cloned_chunks = job_data.get("clonedAudioChunks", [])
+    elif get_legacy_dubbing_chunks(job_data) is not None:
+        # Legacy inline array (see inference_route)
+        cloned_chunks = job_data["clonedAudioChunks"]
         for chunk in cloned_chunks:
             if chunk["chunkId"] == chunk_id:
                 chunk["status"] = "completed"
@@ -622,6 +796,26 @@ def _handle_multi_chunk_completion(
         })
         chunk_urls = [c["audioUrl"] for c in cloned_chunks if c.get("audioUrl")]
         gcs_bucket = config.GCS_DUBBING_BUCKET
+        
+    else:  # dubbing
+        completed_chunks = _complete_dubbing_chunk(
+            db.transaction(),
+            job_ref,
+            get_dubbing_chunk_ref(job_ref, chunk_id),
+            {
+                "status": "completed",
+                "audioUrl": chunk_url,
+                "duration": audio_duration,
+                "completedAt": datetime.datetime.now(datetime.timezone.utc),
+                "updatedAt": SERVER_TIMESTAMP
+            }
+        )
+        
+        # Chunk documents are only read back once, for the merge
+        if completed_chunks == total_chunks:
+            cloned_chunks = get_dubbing_chunks(job_ref, total_chunks)
+            chunk_urls = [c["audioUrl"] for c in cloned_chunks if c.get("audioUrl")]
+        gcs_bucket = config.GCS_DUBBING_BUCKET
     
     logger.info(f"✅ Job {job_id}: Completed chunk {chunk_id + 1}/{total_chunks} ({completed_chunks}/{total_chunks} total)")
     
@@ -632,7 +826,7 @@ def _handle_multi_chunk_completion(
         try:
             merged_audio = merge_audio_chunks_from_gcs(gcs_bucket, chunk_urls)
             merged_blob_name = f"jobs/{job_id}/output.wav"
-            upload_to_gcs(gcs_bucket, merged_blob_name, merged_audio.getvalue(), content_type="audio/wav")
+            upload_to_gcs(gcs_bucket, merged_blob_name, merged_audio, content_type="audio/wav")
             
             signed_url = generate_signed_url(gcs_bucket, merged_blob_name, 24, service_account_email=config.SERVICE_ACCOUNT_EMAIL)
             
@@ -650,25 +844,12 @@ def _handle_multi_chunk_completion(
                     logger.info(f"🎥 Job {job_id}: Queuing video merge")
                     
                     try:
-                        tasks_client = tasks_v2.CloudTasksClient()
-                        queue_path = tasks_client.queue_path(
-                            config.GCP_PROJECT,
-                            config.QUEUE_LOCATION,
-                            config.QUEUE_NAME
-                        )
-                        
                         task = {
                             "http_request": {
                                 "http_method": tasks_v2.HttpMethod.POST,
                                 "url": f"{config.CLOUD_RUN_URL}/merge-video",
-                                "headers": {
-                                    "Content-Type": "application/json",
-                                    "X-Internal-Token": config.INTERNAL_TOKEN,
-                                    "Authorization": f"Bearer {config.INTERNAL_TOKEN}" # Add redundancy
-                                },
-                                "body": base64.b64encode(
-                                    json.dumps({"job_id": job_id, "uid": uid}).encode()
-                                ).decode(),
+                                "headers": _MERGE_VIDEO_TASK_HEADERS,
+                                "body": encode_task_body({"job_id": job_id, "uid": uid}),
                             },
                             "dispatch_deadline": {"seconds": config.TASK_DEADLINE},
                         }
@@ -678,7 +859,7 @@ def _handle_multi_chunk_completion(
                                 "service_account_email": config.SERVICE_ACCOUNT_EMAIL
                             }
                         
-                        tasks_client.create_task(request={"parent": queue_path, "task": task})
+                        create_tasks([task])
                         
                         job_ref.update({
                             "status": "merging_video",
@@ -754,7 +935,7 @@ def _handle_single_chunk_completion(
     job_id: str,
     uid: str,
     blob_name: str,
-    audio_bytes: bytes,
+    audio_size: int,
     audio_duration: float,
     total_time: float,
     reserved_cost: int,
@@ -764,14 +945,20 @@ def _handle_single_chunk_completion(
 ):
     """Handle single chunk completion."""
     actual_cost = calculate_cost_from_duration(audio_duration, is_multi_character)
-    confirm_credit_deduction(uid, job_id, actual_cost, collection_name="voiceJobs")
     
-    signed_url = generate_signed_url(config.GCS_BUCKET, blob_name, 24, service_account_email=config.SERVICE_ACCOUNT_EMAIL)
+    # Overlap the credit transaction with signed URL generation (independent I/O)
+    confirm_future = _credit_confirm_executor.submit(
+        confirm_credit_deduction, uid, job_id, actual_cost, collection_name="voiceJobs"
+    )
+    try:
+        signed_url = generate_signed_url(config.GCS_BUCKET, blob_name, 24, service_account_email=config.SERVICE_ACCOUNT_EMAIL)
+    finally:
+        confirm_future.result()
     
     job_ref.update({
         "status": "completed",
         "audioUrl": signed_url,
-        "audioSize": len(audio_bytes),
+        "audioSize": audio_size,
         "duration": audio_duration,
         "processingTimeSeconds": total_time,
         "actualCost": actual_cost,
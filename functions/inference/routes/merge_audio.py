@@ -2,10 +2,10 @@
 import logging
 from datetime import timedelta
 from google.cloud import tasks_v2
-import json
-import base64
 
 from config import config
+from firebase.credits import confirm_credit_deduction, release_credits
+from utils.task_utils import TASK_HEADERS, create_tasks, encode_task_body
 from firebase_admin import firestore
 from utils.cleanup import temp_files
 from utils.gcs_utils import download_to_file, upload_file_to_gcs, generate_signed_url
@@ -15,7 +15,9 @@ from middleware import (
     extract_job_info, 
     get_job_document,
     get_retry_info,
-    update_job_retry_status
+    update_job_retry_status,
+    get_dubbing_chunks,
+    get_legacy_dubbing_chunks
 )
 from google.cloud.firestore import SERVER_TIMESTAMP
 
@@ -50,7 +52,11 @@ def merge_audio_route():
         return {"error": "Job not found"}, 404
 
     try:
-        cloned_chunks = job_data.get("clonedAudioChunks", [])
+        cloned_chunks = get_legacy_dubbing_chunks(job_data)
+        if cloned_chunks is not None:
+            cloned_chunks = sorted(cloned_chunks, key=lambda c: c["chunkId"])
+        else:
+            cloned_chunks = get_dubbing_chunks(job_ref, job_data.get("totalChunks", 0))
         media_type = job_data.get("mediaType", "audio")
         
         job_ref.update({
@@ -60,9 +66,6 @@ def merge_audio_route():
             "updatedAt": SERVER_TIMESTAMP
         })
         
-        # Sort chunks
-        cloned_chunks.sort(key=lambda c: c["chunkId"])
-        
         # Download all chunks using temp_files context manager
         chunk_count = len(cloned_chunks)
         
@@ -113,24 +116,12 @@ def merge_audio_route():
         if media_type == "video":
             logger.info(f"Job {job_id}: Queuing video merge")
             
-            tasks_client = tasks_v2.CloudTasksClient()
-            queue_path = tasks_client.queue_path(
-                config.GCP_PROJECT,
-                config.QUEUE_LOCATION,
-                config.QUEUE_NAME
-            )
-            
             task = {
                 "http_request": {
                     "http_method": tasks_v2.HttpMethod.POST,
                     "url": f"{config.CLOUD_RUN_URL}/merge-video",
-                    "headers": {
-                        "Content-Type": "application/json",
-                        "X-Internal-Token": config.INTERNAL_TOKEN,
-                    },
-                    "body": base64.b64encode(
-                        json.dumps({"job_id": job_id, "uid": uid}).encode()
-                    ).decode(),
+                    "headers": TASK_HEADERS,
+                    "body": encode_task_body({"job_id": job_id, "uid": uid}),
                 },
                 "dispatch_deadline": {"seconds": config.TASK_DEADLINE},
             }
@@ -140,7 +131,7 @@ def merge_audio_route():
                     "service_account_email": config.SERVICE_ACCOUNT_EMAIL
                 }
             
-            tasks_client.create_task(request={"parent": queue_path, "task": task})
+            create_tasks([task])
             
             job_ref.update({
                 "step": "Merging video...",
@@ -152,7 +143,6 @@ def merge_audio_route():
             # Audio-only complete
             signed_url = generate_signed_url(config.GCS_DUBBING_BUCKET, merged_blob_path, 24)
             
-            from firebase.credits import confirm_credit_deduction
             confirm_credit_deduction(uid, job_id, job_data.get("cost", 0), collection_name="dubbingJobs")
             
             job_ref.update({
@@ -175,7 +165,6 @@ def merge_audio_route():
         
         if is_final_attempt:
             update_job_retry_status(job_ref, retry_count, error_msg, True)
-            from firebase.credits import release_credits
             release_credits(uid, job_id, job_data.get("cost", 0), collection_name="dubbingJobs")
             return {"error": error_msg}, 500
         else:
@@ -3,6 +3,7 @@ import logging
 import subprocess
 
 from config import config
+from firebase.credits import confirm_credit_deduction, release_credits
 from firebase_admin import firestore
 from utils.cleanup import temp_file
 from utils.gcs_utils import download_to_file, upload_file_to_gcs, generate_signed_url
@@ -157,7 +158,6 @@ def merge_video_route():
         logger.info(f"Job {job_id}: Video merge complete")
         
         # Confirm credits
-        from firebase.credits import confirm_credit_deduction
         confirm_credit_deduction(uid, job_id, job_data.get("cost", 0), collection_name="dubbingJobs")
         
         job_ref.update({
@@ -208,7 +208,6 @@ def merge_video_route():
         
         if is_final_attempt:
             update_job_retry_status(job_ref, retry_count, error_msg, True)
-            from firebase.credits import release_credits
             release_credits(uid, job_id, job_data.get("cost", 0), collection_name="dubbingJobs")
             return {"error": error_msg}, 500
         else:
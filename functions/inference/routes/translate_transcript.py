@@ -3,8 +3,6 @@ Translate transcript route.
 Translates the transcript and prepares audio chunks for synthesis.
 """
 import logging
-import json
-import base64
 import html
 from google.cloud import translate_v2 as translate
 from google.cloud import tasks_v2
@@ -12,13 +10,16 @@ from firebase_admin import firestore
 from google.cloud.firestore import SERVER_TIMESTAMP
 
 from config import config
+from firebase.credits import release_credits
+from utils.task_utils import TASK_HEADERS, create_tasks, encode_task_body
 from utils.validators import validate_request, TranslateTranscriptRequest
 from middleware import (
     extract_job_info, 
     get_job_document, 
     update_job_status,
     get_retry_info,
-    update_job_retry_status
+    update_job_retry_status,
+    write_dubbing_chunks
 )
 
 logger = logging.getLogger(__name__)
@@ -108,9 +109,8 @@ def translate_transcript_route():
             })
             
         # Update job with translated transcript and initialized chunks
-        job_ref.update({
+        write_dubbing_chunks(job_ref, cloned_audio_chunks, {
             "translatedTranscript": translated_transcript,
-            "clonedAudioChunks": cloned_audio_chunks,
             "targetLanguage": target_language,
             "status": "cloning",
             "step": "Synthesizing dubbed audio...",
@@ -121,13 +121,7 @@ def translate_transcript_route():
         logger.info(f"Job {job_id}: Translation complete, queuing {len(cloned_audio_chunks)} inference tasks")
         
         # Queue inference tasks
-        tasks_client = tasks_v2.CloudTasksClient()
-        queue_path = tasks_client.queue_path(
-            config.GCP_PROJECT,
-            config.QUEUE_LOCATION,
-            config.QUEUE_NAME
-        )
-        
+        tasks = []
         for chunk in cloned_audio_chunks:
             task_payload = {
                 "job_id": job_id,
@@ -139,11 +133,8 @@ def translate_transcript_route():
                 "http_request": {
                     "http_method": tasks_v2.HttpMethod.POST,
                     "url": f"{config.CLOUD_RUN_URL}/inference",
-                    "headers": {
-                        "Content-Type": "application/json",
-                        "X-Internal-Token": config.INTERNAL_TOKEN,
-                    },
-                    "body": base64.b64encode(json.dumps(task_payload).encode()).decode(),
+                    "headers": TASK_HEADERS,
+                    "body": encode_task_body(task_payload),
                 },
                 "dispatch_deadline": {"seconds": config.TASK_DEADLINE},
             }
@@ -152,9 +143,12 @@ def translate_transcript_route():
                 task["http_request"]["oidc_token"] = {
                     "service_account_email": config.SERVICE_ACCOUNT_EMAIL
                 }
-                
-            tasks_client.create_task(request={"parent": queue_path, "task": task})
             
+            tasks.append(task)
+        
+        if tasks:
+            create_tasks(tasks)
+        
         return {
             "success": True, 
             "segments": len(translated_transcript),
@@ -167,7 +161,6 @@ def translate_transcript_route():
         
         if is_final_attempt:
             update_job_retry_status(job_ref, retry_count, error_msg, True)
-            from firebase.credits import release_credits
             release_credits(uid, job_id, job_data.get("cost", 0), collection_name="dubbingJobs")
             return {"error": error_msg}, 500
         else:
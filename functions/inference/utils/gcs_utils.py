@@ -4,7 +4,7 @@ Google Cloud Storage utilities with retry logic and circuit breaker.
 Handles file uploads, downloads, and signed URL generation.
 """
 import logging
-from typing import Optional, BinaryIO
+from typing import Optional, BinaryIO, Union
 from datetime import timedelta
 from io import BytesIO
 from concurrent.futures import ThreadPoolExecutor, as_completed
@@ -39,7 +39,7 @@ storage_client = storage.Client()
 def upload_to_gcs(
     bucket_name: str,
     blob_path: str,
-    data: bytes,
+    data: Union[bytes, BinaryIO],
     content_type: str = "application/octet-stream"
 ) -> storage.Blob:
     """
@@ -48,7 +48,8 @@ def upload_to_gcs(
     Args:
         bucket_name: GCS bucket name
         blob_path: Path within bucket
-        data: Binary data to upload
+        data: Binary data to upload, or a seekable file object to stream
+            from its start (avoids copying an in-memory buffer to bytes)
         content_type: MIME type
     
     Returns:
@@ -59,9 +60,20 @@ def upload_to_gcs(
     """
     bucket = storage_client.bucket(bucket_name)
     blob = bucket.blob(blob_path)
-    blob.upload_from_string(data, content_type=content_type)
-    
-    logger.info(f"Uploaded to gs://{bucket_name}/{blob_path} ({len(data)} bytes)")
+    if isinstance(data, bytes):
+        size = len(data)
+        blob.upload_from_string(data, content_type=content_type)
+    else:
+        # Passing the size keeps this a single multipart request; without it
+        # the client opens a resumable session (extra round trips).
+        # rewind=True also makes a retried attempt start from the beginning
+        if isinstance(data, BytesIO):
+            size = data.getbuffer().nbytes
+        else:
+            size = data.seek(0, 2)
+        blob.upload_from_file(data, rewind=True, size=size, content_type=content_type)
+    
+    logger.info(f"Uploaded to gs://{bucket_name}/{blob_path} ({size} bytes)")
     return blob
 
 
@@ -274,7 +286,7 @@ def merge_audio_chunks_from_gcs(
 
 def batch_delete_blobs(bucket_name: str, blob_paths: list[str]) -> int:
     """
-    Delete multiple blobs from GCS.
+    Delete multiple blobs from GCS in parallel.
     
     Args:
         bucket_name: GCS bucket name
@@ -283,16 +295,29 @@ def batch_delete_blobs(bucket_name: str, blob_paths: list[str]) -> int:
     Returns:
         Number of successfully deleted blobs
     """
+    if not blob_paths:
+        return 0
+    
     bucket = storage_client.bucket(bucket_name)
     deleted = 0
     
-    for blob_path in blob_paths:
-        try:
-            blob = bucket.blob(blob_path)
-            blob.delete()
-            deleted += 1
-        except Exception as e:
-            logger.warning(f"Failed to delete {blob_path}: {e}")
+    def delete_blob(blob_path: str) -> None:
+        """Delete a single blob"""
+        bucket.blob(blob_path).delete()
+    
+    # Delete blobs in parallel (each delete is an independent HTTPS round-trip)
+    with ThreadPoolExecutor(max_workers=min(32, len(blob_paths))) as executor:
+        futures = {
+            executor.submit(delete_blob, blob_path): blob_path
+            for blob_path in blob_paths
+        }
+        
+        for future in as_completed(futures):
+            try:
+                future.result()
+                deleted += 1
+            except Exception as e:
+                logger.warning(f"Failed to delete {futures[future]}: {e}")
     
     logger.info(f"Deleted {deleted}/{len(blob_paths)} blobs")
     return deleted
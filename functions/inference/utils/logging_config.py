@@ -8,6 +8,10 @@ import uuid
 from typing import Optional, Dict, Any
 from flask import request, g, has_request_context
 
+# Name given to the root handler installed by setup_logging, so repeated
+# calls (or a re-imported module) do not stack duplicate handlers
+_HANDLER_NAME = "inference-console"
+
 
 class RequestContextFilter(logging.Filter):
     """Add request and job context to log records"""
@@ -30,6 +34,11 @@ def setup_logging(log_level: str = "INFO") -> None:
     Args:
         log_level: Logging level (DEBUG, INFO, WARNING, ERROR, CRITICAL)
     """
+    root_logger = logging.getLogger()
+    if any(h.get_name() == _HANDLER_NAME for h in root_logger.handlers):
+        root_logger.setLevel(log_level)
+        return
+    
     # Create formatter with request context
     formatter = logging.Formatter(
         fmt='%(asctime)s | %(request_id)s | %(job_id)s | %(levelname)s | %(name)s | %(message)s',
@@ -37,7 +46,6 @@ def setup_logging(log_level: str = "INFO") -> None:
     )
     
     # Configure root logger
-    root_logger = logging.getLogger()
     root_logger.setLevel(log_level)
     
     # Remove existing handlers
@@ -46,6 +54,7 @@ def setup_logging(log_level: str = "INFO") -> None:
     
     # Add console handler
     console_handler = logging.StreamHandler()
+    console_handler.set_name(_HANDLER_NAME)
     console_handler.setFormatter(formatter)
     console_handler.addFilter(RequestContextFilter())
     root_logger.addHandler(console_handler)
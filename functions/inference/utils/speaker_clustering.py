@@ -75,8 +75,8 @@ def cluster_speakers_embeddings(
     labels = clustering.fit_predict(embeddings)
     
     # Count noise points and valid clusters
-    noise_count = sum(1 for l in labels if l == -1)
-    max_cluster_id = max(labels) if len(labels) > 0 else -1
+    noise_count = int(np.count_nonzero(labels == -1))
+    max_cluster_id = int(labels.max()) if len(labels) > 0 else -1
     
     logger.info(f"DBSCAN found {max_cluster_id + 1} clusters, {noise_count} noise points")
     
@@ -169,4 +169,26 @@ def generate_speaker_sample(
 
 def compute_speaker_similarity(embed1: np.ndarray, embed2: np.ndarray) -> float:
     """Compute cosine similarity between two speaker embeddings"""
-    return np.dot(embed1, embed2) / (np.linalg.norm(embed1) * np.linalg.norm(embed2))
\ No newline at end of file
+    return np.dot(embed1, embed2) / (np.linalg.norm(embed1) * np.linalg.norm(embed2))
+
+
+def compute_speaker_similarity_normalized(embed1: np.ndarray, embed2: np.ndarray) -> float:
+    """
+    Compute cosine similarity between two unit-norm speaker embeddings.
+    
+    Resemblyzer's embed_utterance already returns L2-normalized vectors,
+    so the similarity reduces to a single dot product.
+    """
+    return float(embed1 @ embed2)
+
+
+def similarity_matrix(embeddings: np.ndarray) -> np.ndarray:
+    """
+    Compute pairwise cosine similarities for a stack of unit-norm embeddings.
+    
+    Args:
+        embeddings: Array of shape (n, d) with L2-normalized rows
+    
+    Returns: (n, n) similarity matrix
+    """
+    return embeddings @ embeddings.T
\ No newline at end of file
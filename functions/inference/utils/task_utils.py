@@ -0,0 +1,104 @@
+# functions/inference/utils/task_utils.py
+"""
+Shared Cloud Tasks client for queuing follow-up pipeline steps.
+"""
+import logging
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+from google.cloud import tasks_v2
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+from config import config
+
+logger = logging.getLogger(__name__)
+
+# Client and queue path are created once per instance and reused across
+# requests, so the gRPC channel and auth setup are paid only on first use
+_tasks_client: Optional[tasks_v2.CloudTasksClient] = None
+_queue_path: Optional[str] = None
+_init_lock = threading.Lock()
+
+# Request headers shared by every task (tasks_v2 copies them into each message)
+TASK_HEADERS = {
+    "Content-Type": "application/json",
+    "X-Internal-Token": config.INTERNAL_TOKEN,
+}
+
+# create_task deadline, so a stalled queue fails the step quickly and Cloud
+# Tasks retries it instead of the request hanging on the client default
+CREATE_TASK_TIMEOUT_SECONDS = 5.0
+
+# Cloud Tasks has no batch RPC; fan-outs issue create_task concurrently on
+# the shared (thread-safe) client instead
+BATCH_TASK_MAX_WORKERS = 8
+_task_executor = ThreadPoolExecutor(max_workers=BATCH_TASK_MAX_WORKERS, thread_name_prefix="cloud-tasks")
+
+
+def get_tasks_client() -> tasks_v2.CloudTasksClient:
+    """Get or create Cloud Tasks client singleton."""
+    global _tasks_client, _queue_path
+
+    if _tasks_client is None:
+        with _init_lock:
+            if _tasks_client is None:
+                client = tasks_v2.CloudTasksClient()
+                _queue_path = client.queue_path(
+                    config.GCP_PROJECT,
+                    config.QUEUE_LOCATION,
+                    config.QUEUE_NAME
+                )
+                _tasks_client = client
+                logger.info(f"Initialized Cloud Tasks client for queue: {_queue_path}")
+
+    return _tasks_client
+
+
+def get_queue_path() -> str:
+    """Get Cloud Tasks queue path."""
+    get_tasks_client()  # Ensure initialization
+    if _queue_path is None:
+        raise RuntimeError("Queue path not initialized")
+    return _queue_path
+
+
+def encode_task_body(payload: Dict[str, Any]) -> bytes:
+    """
+    Encode a task payload as the raw HTTP request body.
+    
+    The bytes are passed straight to the task's http_request.body, so no
+    base64 round trip is needed (orjson emits UTF-8 bytes directly).
+    """
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload).encode()
+
+
+def create_tasks(tasks: List[Dict[str, Any]]) -> None:
+    """
+    Create several tasks on the shared queue concurrently.
+    
+    Raises the first create_task error, in task order.
+    """
+    client = get_tasks_client()
+    queue_path = get_queue_path()
+    
+    def create(task: Dict[str, Any]) -> None:
+        client.create_task(
+            request={"parent": queue_path, "task": task},
+            timeout=CREATE_TASK_TIMEOUT_SECONDS
+        )
+    
+    if len(tasks) == 1:
+        create(tasks[0])
+        return
+    
+    futures = [_task_executor.submit(create, task) for task in tasks]
+    for future in futures:
+        future.result()
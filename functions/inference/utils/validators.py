@@ -3,23 +3,45 @@
 Input validation using Pydantic models.
 Ensures type safety and validates constraints before processing.
 """
-from typing import Optional, List, Dict, TypeVar, Type
-from pydantic import BaseModel, Field, field_validator, ValidationError
+from typing import Annotated, Optional, List, Dict, TypeVar, Type
+from annotated_types import Ge, MaxLen, MinLen
+from pydantic import BaseModel, StringConstraints, TypeAdapter, field_validator, ValidationError
 import logging
+import subprocess
+import soundfile as sf
 
 from config import config
 
+try:
+    import av
+except ImportError:
+    av = None
+
 logger = logging.getLogger(__name__)
 
 T = TypeVar("T", bound=BaseModel)
 
+# Fields every transcript segment must carry
+_REQ_TRANSCRIPT_FIELDS = ('text', 'startTime', 'endTime')
+
+# Constrained field types (compiled straight into the pydantic-core schema)
+Identifier = Annotated[str, MinLen(1), MaxLen(100)]
+NonEmptyStr = Annotated[str, MinLen(1)]
+NonNegativeInt = Annotated[int, Ge(0)]
+MediaType = Annotated[str, StringConstraints(pattern="^(audio|video)$")]
+LanguageCode = Annotated[str, MinLen(2), MaxLen(10)]
+
+
+class PayloadTooLargeError(ValueError):
+    """Raised when a request body exceeds config.MAX_PAYLOAD_SIZE"""
+
 
 class InferenceRequest(BaseModel):
     """Validation model for inference requests"""
     
-    job_id: str = Field(..., min_length=1, max_length=100)
-    uid: str = Field(..., min_length=1, max_length=100)
-    chunk_id: Optional[int] = Field(None, ge=0)
+    job_id: Identifier
+    uid: Identifier
+    chunk_id: Optional[NonNegativeInt] = None
     
     class Config:
         # Allow extra fields but don't include them
@@ -29,10 +51,10 @@ class InferenceRequest(BaseModel):
 class ExtractAudioRequest(BaseModel):
     """Validation model for audio extraction requests"""
     
-    job_id: str = Field(..., min_length=1, max_length=100)
-    uid: str = Field(..., min_length=1, max_length=100)
-    media_path: str = Field(..., min_length=1)
-    media_type: str = Field("audio", pattern="^(audio|video)$")
+    job_id: Identifier
+    uid: Identifier
+    media_path: NonEmptyStr
+    media_type: MediaType = "audio"
     
     class Config:
         extra = 'ignore'
@@ -41,9 +63,9 @@ class ExtractAudioRequest(BaseModel):
 class ClusterSpeakersRequest(BaseModel):
     """Validation model for speaker clustering requests"""
     
-    job_id: str = Field(..., min_length=1, max_length=100)
-    uid: str = Field(..., min_length=1, max_length=100)
-    audio_path: str = Field(..., min_length=1)
+    job_id: Identifier
+    uid: Identifier
+    audio_path: NonEmptyStr
     
     class Config:
         extra = 'ignore'
@@ -53,9 +75,9 @@ class ClusterSpeakersRequest(BaseModel):
 class TranslateTranscriptRequest(BaseModel):
     """Validation model for transcript translation requests"""
     
-    job_id: str = Field(..., min_length=1, max_length=100)
-    uid: str = Field(..., min_length=1, max_length=100)
-    target_language: str = Field(..., min_length=2, max_length=10)
+    job_id: Identifier
+    uid: Identifier
+    target_language: LanguageCode
     
     class Config:
         extra = 'ignore'
@@ -64,9 +86,9 @@ class TranslateTranscriptRequest(BaseModel):
 class CloneAudioRequest(BaseModel):
     """Validation model for audio cloning requests"""
     
-    job_id: str = Field(..., min_length=1, max_length=100)
-    uid: str = Field(..., min_length=1, max_length=100)
-    chunk_id: int = Field(..., ge=0)
+    job_id: Identifier
+    uid: Identifier
+    chunk_id: NonNegativeInt
     
     class Config:
         extra = 'ignore'
@@ -75,13 +97,35 @@ class CloneAudioRequest(BaseModel):
 class MergeRequest(BaseModel):
     """Validation model for merge requests (audio/video)"""
     
-    job_id: str = Field(..., min_length=1, max_length=100)
-    uid: str = Field(..., min_length=1, max_length=100)
+    job_id: Identifier
+    uid: Identifier
     
     class Config:
         extra = 'ignore'
 
 
+# Pre-built validators (schema compiled once at import, reused per request)
+_ADAPTERS: Dict[type, TypeAdapter] = {
+    model: TypeAdapter(model)
+    for model in (
+        InferenceRequest,
+        ExtractAudioRequest,
+        ClusterSpeakersRequest,
+        TranslateTranscriptRequest,
+        CloneAudioRequest,
+        MergeRequest,
+    )
+}
+
+
+def _get_adapter(model_class: Type[T]) -> TypeAdapter:
+    """Get the cached TypeAdapter for a model, building it on first use."""
+    adapter = _ADAPTERS.get(model_class)
+    if adapter is None:
+        adapter = _ADAPTERS[model_class] = TypeAdapter(model_class)
+    return adapter
+
+
 def validate_request(model_class: Type[T], data: dict) -> T:
     """
     Validate request data against a Pydantic model.
@@ -104,7 +148,45 @@ def validate_request(model_class: Type[T], data: dict) -> T:
             return jsonify({"error": e.errors()}), 400
     """
     try:
-        return model_class(**data)
+        return _get_adapter(model_class).validate_python(data)
+    except ValidationError as e:
+        logger.warning(f"Validation failed: {e.errors()}")
+        raise
+
+
+def validate_request_json(model_class: Type[T], body: bytes) -> T:
+    """
+    Validate a raw JSON request body against a Pydantic model.
+    
+    Parses and validates in a single pass inside pydantic-core, skipping
+    the intermediate Python dict built by request.get_json().
+    
+    Args:
+        model_class: Pydantic model class
+        body: Raw JSON request body
+    
+    Returns:
+        Validated model instance
+    
+    Raises:
+        PayloadTooLargeError: If the body exceeds config.MAX_PAYLOAD_SIZE
+        ValidationError: If the body is not valid JSON or validation fails
+    
+    Usage:
+        try:
+            req = validate_request_json(InferenceRequest, request.get_data())
+        except ValidationError as e:
+            return jsonify({"error": e.errors()}), 400
+    """
+    # Reject oversized bodies before pydantic walks them
+    if len(body) > config.MAX_PAYLOAD_SIZE:
+        logger.warning(f"Payload too large: {len(body)} bytes")
+        raise PayloadTooLargeError(
+            f"Payload of {len(body)} bytes exceeds limit of {config.MAX_PAYLOAD_SIZE} bytes"
+        )
+    
+    try:
+        return _get_adapter(model_class).validate_json(body)
     except ValidationError as e:
         logger.warning(f"Validation failed: {e.errors()}")
         raise
@@ -120,8 +202,6 @@ def validate_audio_format(file_path: str) -> bool:
     Returns:
         True if valid audio format
     """
-    import soundfile as sf
-    
     try:
         info = sf.info(file_path)
         return info.samplerate > 0 and info.channels in [1, 2]
@@ -132,7 +212,10 @@ def validate_audio_format(file_path: str) -> bool:
 
 def validate_video_format(file_path: str) -> bool:
     """
-    Validate video file format using ffprobe.
+    Validate video file format.
+    
+    Reads container metadata in-process with PyAV when available,
+    falling back to spawning ffprobe.
     
     Args:
         file_path: Path to video file
@@ -140,7 +223,13 @@ def validate_video_format(file_path: str) -> bool:
     Returns:
         True if valid video format
     """
-    import subprocess
+    if av is not None:
+        try:
+            with av.open(file_path, metadata_errors='ignore') as container:
+                return bool(container.streams.video)
+        except Exception as e:
+            logger.error(f"Invalid video format: {e}")
+            return False
     
     try:
         result = subprocess.run(
@@ -168,14 +257,13 @@ def validate_transcript(transcript: List[dict]) -> bool:
     if not transcript or not isinstance(transcript, list):
         return False
     
-    required_fields = {'text', 'startTime', 'endTime'}
-    
     for segment in transcript:
         if not isinstance(segment, dict):
             return False
         
-        if not required_fields.issubset(segment.keys()):
-            return False
+        for field in _REQ_TRANSCRIPT_FIELDS:
+            if field not in segment:
+                return False
         
         # Validate time ordering
         if segment['startTime'] >= segment['endTime']:
@@ -2,23 +2,46 @@
 """
 Firebase authentication utilities with enhanced error handling and logging.
 """
-import firebase_admin
-from firebase_admin import auth, credentials
+from firebase_admin import auth
+import hashlib
 import logging
+import os
+import threading
 import time
 from typing import Optional, Dict, Any
+from cachetools import TLRUCache, TTLCache
 from flask import Request
 
-logger = logging.getLogger(__name__)
+from firebase.db import ensure_firebase_initialized
 
-def _ensure_firebase_initialized():
-    """Ensure Firebase is initialized (lazy initialization)."""
-    if not firebase_admin._apps:
-        cred = credentials.ApplicationDefault()
-        firebase_admin.initialize_app(cred)
+logger = logging.getLogger(__name__)
 
 # Constants
 TOKEN_EXPIRY_WARNING_SECONDS = 300  # 5 minutes
+ADMIN_CACHE_TTL_SECONDS = 60
+ADMIN_CACHE_MAX_SIZE = 1024
+_BEARER_PREFIX = "Bearer "
+_BEARER_PREFIX_LEN = len(_BEARER_PREFIX)
+
+# Admin claim cache (claims change on the order of minutes, not requests)
+_admin_cache: TTLCache = TTLCache(maxsize=ADMIN_CACHE_MAX_SIZE, ttl=ADMIN_CACHE_TTL_SECONDS)
+_admin_cache_lock = threading.Lock()
+
+# Decoded ID token cache keyed by SHA-256(token). Disable with
+# TOKEN_CACHE_ENABLED=false where every request must hit verify_id_token.
+TOKEN_CACHE_ENABLED = os.environ.get("TOKEN_CACHE_ENABLED", "true").lower() != "false"
+TOKEN_CACHE_MAX_TTL_SECONDS = 300
+TOKEN_CACHE_MAX_SIZE = 4096
+
+
+def _token_ttu(_key: bytes, decoded: Dict[str, Any], now: float) -> float:
+    """Expire cached tokens at `exp`, capped at TOKEN_CACHE_MAX_TTL_SECONDS."""
+    time_to_expiry = decoded.get('exp', 0) - time.time()
+    return now + min(time_to_expiry, TOKEN_CACHE_MAX_TTL_SECONDS)
+
+
+_token_cache: TLRUCache = TLRUCache(maxsize=TOKEN_CACHE_MAX_SIZE, ttu=_token_ttu)
+_token_cache_lock = threading.Lock()
 
 
 def get_current_user(request: Request) -> Optional[Dict[str, Any]]:
@@ -31,7 +54,7 @@ def get_current_user(request: Request) -> Optional[Dict[str, Any]]:
     Returns:
         Decoded token dictionary if valid, None otherwise
     """
-    _ensure_firebase_initialized()
+    ensure_firebase_initialized()
     
     auth_header = request.headers.get("Authorization")
     
@@ -39,15 +62,27 @@ def get_current_user(request: Request) -> Optional[Dict[str, Any]]:
         logger.warning("Authentication failed: Missing Authorization header")
         return None
         
-    if not auth_header.startswith("Bearer "):
+    if not auth_header.startswith(_BEARER_PREFIX):
         logger.warning(f"Authentication failed: Invalid header format. Received: {auth_header[:10]}...")
         return None
         
-    id_token = auth_header.split("Bearer ")[1]
+    id_token = auth_header[_BEARER_PREFIX_LEN:]
+    
+    cache_key = hashlib.sha256(id_token.encode()).digest() if TOKEN_CACHE_ENABLED else None
     
     try:
-        # Verify the token
-        decoded = auth.verify_id_token(id_token)
+        decoded = None
+        if cache_key is not None:
+            with _token_cache_lock:
+                decoded = _token_cache.get(cache_key)
+        
+        if decoded is None:
+            # Verify the token
+            decoded = auth.verify_id_token(id_token)
+            
+            if cache_key is not None:
+                with _token_cache_lock:
+                    _token_cache[cache_key] = decoded
         
         # Check if token is about to expire
         exp_time = decoded.get('exp', 0)
@@ -78,6 +113,7 @@ def get_current_user(request: Request) -> Optional[Dict[str, Any]]:
 def verify_admin_access(uid: str) -> bool:
     """
     Check if user has admin privileges.
+    Results are cached per uid for ADMIN_CACHE_TTL_SECONDS.
     
     Args:
         uid: User ID
@@ -85,10 +121,20 @@ def verify_admin_access(uid: str) -> bool:
     Returns:
         True if user is admin, False otherwise
     """
+    with _admin_cache_lock:
+        cached = _admin_cache.get(uid)
+    if cached is not None:
+        return cached
+    
     try:
         user = auth.get_user(uid)
         custom_claims = user.custom_claims or {}
-        return custom_claims.get('admin', False)
+        is_admin = bool(custom_claims.get('admin', False))
+        
+        with _admin_cache_lock:
+            _admin_cache[uid] = is_admin
+        
+        return is_admin
     except Exception as e:
         logger.error(f"Failed to verify admin access for {uid}: {str(e)}")
         return False
\ No newline at end of file
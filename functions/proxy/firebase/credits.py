@@ -3,19 +3,47 @@
 Enhanced credit management with race condition prevention.
 All credit operations are atomic and idempotent.
 """
-from firebase_admin import firestore
+from google.api_core.exceptions import AlreadyExists, FailedPrecondition
 from google.cloud.firestore import transactional, SERVER_TIMESTAMP, Increment
 from typing import Tuple, Optional, Dict, Any
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import ThreadPoolExecutor
+from cachetools import TTLCache
 import logging
-import sys
 import math
+import threading
+import time
 
 from utils import MULTI_CHARACTER_MULTIPLIER, SECONDS_PER_CREDIT, DUBBING_TRANSLATION_MULTIPLIER, DUBBING_VIDEO_MULTIPLIER, PENDING_CREDIT_TIMEOUT_HOURS
 from utils.logging_config import get_logger
+from firebase.db import get_db
 
 logger = get_logger(__name__)
 
+# Lifetime of a pending reservation before cleanup may release it
+_PENDING_DELTA = timedelta(hours=PENDING_CREDIT_TIMEOUT_HOURS)
+
+# Optimistic credit writes: preconditioned batch commits retried with
+# exponential backoff when a concurrent writer wins
+OPTIMISTIC_WRITE_ATTEMPTS = 3
+OPTIMISTIC_WRITE_BACKOFF_SECONDS = 0.05
+
+# Max concurrent per-user settlements during stale credit cleanup
+CLEANUP_MAX_WORKERS = 16
+
+# Per-process idempotency guards keyed by (collection, job_id). These only
+# short-circuit duplicate calls seen by this instance; cross-instance
+# duplicates still fall through to the transactional checks.
+RECENT_JOB_CACHE_SIZE = 10_000
+RECENT_JOB_CACHE_TTL_SECONDS = 60
+_recent_reservations: TTLCache = TTLCache(maxsize=RECENT_JOB_CACHE_SIZE, ttl=RECENT_JOB_CACHE_TTL_SECONDS)
+_recent_confirmations: TTLCache = TTLCache(maxsize=RECENT_JOB_CACHE_SIZE, ttl=RECENT_JOB_CACHE_TTL_SECONDS)
+_recent_jobs_lock = threading.Lock()
+
+
+class _JobExists(ValueError):
+    """Raised inside reserve_credits when the job document already exists."""
+
 
 def calculate_cost(character_texts: Optional[list] = None) -> int:
     """Calculate cost based on number of characters"""
@@ -46,6 +74,140 @@ def calculate_dubbing_cost(
     return max(1, math.ceil(base_credits * translation_mult * video_mult))
 
 
+def _check_reservable(uid: str, user_data: Dict[str, Any], cost: int) -> None:
+    """Raise ValueError if the user cannot cover `cost` on top of pending credits."""
+    is_pro = user_data.get("isPro", False)
+    total_credits = user_data.get("credits", 0)
+    pending_credits = user_data.get("pendingCredits", 0)
+    
+    logger.info(
+        f"User {uid}: total_credits={total_credits}, "
+        f"pending_credits={pending_credits}, is_pro={is_pro}"
+    )
+    
+    # Calculate available credits
+    available_credits = total_credits - pending_credits
+    
+    logger.info(f"Available credits: {available_credits}, Required: {cost}")
+    
+    # Credit check (applies to ALL users now)
+    if available_credits < cost:
+        error_msg = f"Insufficient credits. Available: {available_credits}, Required: {cost}"
+        logger.warning(f"Credit check failed for user {uid}: {error_msg}")
+        raise ValueError(error_msg)
+    
+    logger.info(f"Credit check passed for user {uid}")
+
+
+def _reservation_user_updates(cost: int) -> Dict[str, Any]:
+    """User document update that reserves credits by incrementing pendingCredits."""
+    logger.info(f"Incrementing pendingCredits by {cost}")
+    return {
+        "updatedAt": SERVER_TIMESTAMP,
+        "pendingCredits": Increment(cost)
+    }
+
+
+def _reserved_job_doc(uid: str, cost: int, job_data: Dict[str, Any], is_pro: bool) -> Dict[str, Any]:
+    """
+    Build a job document carrying the credit reservation flags.
+    The tier at reservation time is recorded as wasPro so settlement does
+    not need to re-read the user document. This path increments
+    pendingCredits for every tier, so pendingReserved is always True;
+    settlement decrements pendingCredits only for jobs that carry it.
+    """
+    job_doc_data = {
+        "uid": uid,
+        "status": "queued",
+        "cost": cost,
+        "wasPro": is_pro,
+        "pendingReserved": True,
+        "createdAt": SERVER_TIMESTAMP,
+        "updatedAt": SERVER_TIMESTAMP,
+        "pendingCreditExpiry": datetime.now(timezone.utc) + _PENDING_DELTA,
+        "creditsReserved": True,
+        "creditsConfirmed": False,
+        # Written explicitly: the stale pending-credit cleanup filters on
+        # creditsReleased == False, which never matches a missing field
+        "creditsReleased": False,
+    }
+    
+    # Merge in any additional job data
+    job_doc_data.update(job_data)
+    return job_doc_data
+
+
+def _reserve_credits_batch(
+    db,
+    user_ref,
+    job_ref,
+    uid: str,
+    job_id: str,
+    cost: int,
+    job_data: Dict[str, Any]
+) -> bool:
+    """
+    Reserve credits with one read and a preconditioned WriteBatch.
+    
+    The user update carries a last_update_time precondition and the job is
+    written with create(), so a concurrent change to either rejects the
+    commit instead of overwriting it. Rejected commits are retried with
+    exponential backoff.
+    
+    Returns:
+        True if the reservation was committed, False if the caller should
+        fall back to the transactional path (retries exhausted, or a failed
+        job is being overwritten)
+        
+    Raises:
+        ValueError: If the job already exists or credits are insufficient
+    """
+    for attempt in range(OPTIMISTIC_WRITE_ATTEMPTS):
+        snapshots = {snap.reference.path: snap for snap in db.get_all([job_ref, user_ref])}
+        job_snapshot = snapshots[job_ref.path]
+        user_snapshot = snapshots[user_ref.path]
+        
+        if job_snapshot.exists:
+            if (job_snapshot.to_dict() or {}).get("status") != "failed":
+                logger.error(f"Job {job_id} already exists and is not failed - double reservation prevented")
+                raise _JobExists("Job already exists")
+            return False
+        
+        if not user_snapshot.exists:
+            logger.error(f"User {uid} document not found")
+            raise ValueError("User document not found")
+        
+        user_data = user_snapshot.to_dict() or {}
+        _check_reservable(uid, user_data, cost)
+        
+        batch = db.batch()
+        batch.update(
+            user_ref,
+            _reservation_user_updates(cost),
+            option=db.write_option(last_update_time=user_snapshot.update_time)
+        )
+        batch.create(job_ref, _reserved_job_doc(uid, cost, job_data, user_data.get("isPro", False)))
+        
+        try:
+            batch.commit()
+        except AlreadyExists:
+            logger.error(f"Job {job_id} was created concurrently - double reservation prevented")
+            raise _JobExists("Job already exists")
+        except FailedPrecondition:
+            logger.info(
+                f"User {uid} changed during reservation of job {job_id} "
+                f"(attempt {attempt + 1}/{OPTIMISTIC_WRITE_ATTEMPTS})"
+            )
+            time.sleep(OPTIMISTIC_WRITE_BACKOFF_SECONDS * (2 ** attempt))
+            continue
+        
+        logger.info(f"✓ Reserved {cost} credits for user {uid}, job {job_id}")
+        return True
+    
+    logger.info(f"Optimistic reservation for job {job_id} exhausted retries, using transaction")
+    return False
+
+
 def reserve_credits(
     uid: str, 
     job_id: str, 
@@ -69,7 +231,14 @@ def reserve_credits(
     """
     logger.info(f"reserve_credits called: uid={uid}, job_id={job_id}, cost={cost}, collection={collection_name}")
     
-    db = firestore.client()
+    cache_key = (collection_name, job_id)
+    with _recent_jobs_lock:
+        recently_reserved = cache_key in _recent_reservations
+    if recently_reserved:
+        logger.warning(f"✗ Job {job_id} was just reserved by this instance - double reservation prevented")
+        return False, "Job already exists"
+    
+    db = get_db()
     user_ref = db.collection("users").document(uid)
     job_ref = db.collection(collection_name).document(job_id)
     
@@ -77,19 +246,14 @@ def reserve_credits(
     def update_in_transaction(transaction):
         logger.info(f"Transaction started for job {job_id}")
         
-        try:
-            job_snapshot = job_ref.get(transaction=transaction)
-            if job_snapshot.exists:
-                current_job = job_snapshot.to_dict() or {}
-                if current_job.get("status") != "failed":
-                    logger.error(f"Job {job_id} already exists and is not failed - double reservation prevented")
-                    raise ValueError("Job already exists")
-                else:
-                    logger.info(f"Job {job_id} exists but is failed - allowing retry/overwrite")
-        except Exception as e:
-            if "already exists" in str(e):
-                raise
-            logger.debug(f"Job {job_id} doesn't exist (expected): {str(e)}")
+        job_snapshot = job_ref.get(field_paths=["status"], transaction=transaction)
+        if job_snapshot.exists:
+            current_job = job_snapshot.to_dict() or {}
+            if current_job.get("status") != "failed":
+                logger.error(f"Job {job_id} already exists and is not failed - double reservation prevented")
+                raise _JobExists("Job already exists")
+            else:
+                logger.info(f"Job {job_id} exists but is failed - allowing retry/overwrite")
         
         # Get user document
         user_snapshot = user_ref.get(transaction=transaction)
@@ -98,77 +262,57 @@ def reserve_credits(
             raise ValueError("User document not found")
         
         user_data = user_snapshot.to_dict() or {}
-        is_pro = user_data.get("isPro", False)
-        total_credits = user_data.get("credits", 0)
-        pending_credits = user_data.get("pendingCredits", 0)
-        
-        logger.info(
-            f"User {uid}: total_credits={total_credits}, "
-            f"pending_credits={pending_credits}, is_pro={is_pro}"
-        )
-        
-        # Calculate available credits
-        available_credits = total_credits - pending_credits
-        
-        logger.info(f"Available credits: {available_credits}, Required: {cost}")
-        
-        # Credit check (applies to ALL users now)
-        if available_credits < cost:
-            error_msg = f"Insufficient credits. Available: {available_credits}, Required: {cost}"
-            logger.warning(f"Credit check failed for user {uid}: {error_msg}")
-            raise ValueError(error_msg)
-        
-        logger.info(f"Credit check passed for user {uid}")
+        _check_reservable(uid, user_data, cost)
         
-        # Reserve credits by incrementing pendingCredits
-        user_updates: Dict[str, Any] = {
-            "updatedAt": SERVER_TIMESTAMP,
-            "pendingCredits": Increment(cost)
-        }
-        logger.info(f"Incrementing pendingCredits by {cost}")
-        
-        transaction.update(user_ref, user_updates)
+        transaction.update(user_ref, _reservation_user_updates(cost))
         logger.info(f"User credits updated for {uid}")
         
-        # Create job document with reservation flag
-        job_doc_data = {
-            "uid": uid,
-            "status": "queued",
-            "cost": cost,
-            "createdAt": SERVER_TIMESTAMP,
-            "updatedAt": SERVER_TIMESTAMP,
-            "pendingCreditExpiry": datetime.utcnow() + timedelta(hours=PENDING_CREDIT_TIMEOUT_HOURS),
-            "creditsReserved": True,
-            "creditsConfirmed": False,
-        }
-        
-        # Merge in any additional job data
-        job_doc_data.update(job_data)
-        
-        transaction.set(job_ref, job_doc_data)
+        transaction.set(job_ref, _reserved_job_doc(uid, cost, job_data, user_data.get("isPro", False)))
         logger.info(f"Job document created in {collection_name}/{job_id}")
         
         logger.info(f"✓ Reserved {cost} credits for user {uid}, job {job_id}")
         return True, None
     
     try:
-        transaction = db.transaction()
-        result = update_in_transaction(transaction)
-        logger.info(f"Transaction completed successfully for job {job_id}")
-        sys.stdout.flush()
+        if _reserve_credits_batch(db, user_ref, job_ref, uid, job_id, cost, job_data):
+            result = (True, None)
+        else:
+            transaction = db.transaction()
+            result = update_in_transaction(transaction)
+            logger.info(f"Transaction completed successfully for job {job_id}")
+        with _recent_jobs_lock:
+            _recent_reservations[cache_key] = True
         return result
     except ValueError as e:
         logger.warning(f"✗ Credit reservation failed for {uid}: {str(e)}")
-        sys.stdout.flush()
         return False, str(e)
     except Exception as e:
         logger.error(f"✗ Credit reservation transaction failed: {str(e)}")
         import traceback
         logger.error(traceback.format_exc())
-        sys.stdout.flush()
         return False, f"Transaction failed: {str(e)}"
 
 
+def _retry_on_precondition(settle, job_id: str) -> Tuple[bool, Optional[str]]:
+    """
+    Run a read-then-batch settlement, re-reading when its precondition fails.
+    
+    A failed precondition means another writer touched the job between the
+    read and the commit; the next attempt sees its flags and settles
+    idempotently.
+    """
+    for attempt in range(OPTIMISTIC_WRITE_ATTEMPTS):
+        try:
+            return settle()
+        except FailedPrecondition:
+            logger.info(
+                f"Job {job_id} changed during credit settlement "
+                f"(attempt {attempt + 1}/{OPTIMISTIC_WRITE_ATTEMPTS})"
+            )
+            time.sleep(OPTIMISTIC_WRITE_BACKOFF_SECONDS * (2 ** attempt))
+    raise ValueError(f"Job {job_id} kept changing during credit settlement")
+
+
 def confirm_credit_deduction(
     uid: str, 
     job_id: str, 
@@ -190,14 +334,20 @@ def confirm_credit_deduction(
     """
     logger.info(f"Confirming credit deduction: uid={uid}, job_id={job_id}, cost={cost}, collection={collection_name}")
     
-    db = firestore.client()
+    cache_key = (collection_name, job_id)
+    with _recent_jobs_lock:
+        recently_confirmed = cache_key in _recent_confirmations
+    if recently_confirmed:
+        logger.warning(f"Credits already confirmed for job {job_id}")
+        return True, None
+    
+    db = get_db()
     user_ref = db.collection("users").document(uid)
     job_ref = db.collection(collection_name).document(job_id)
     
-    @transactional
-    def update_in_transaction(transaction):
-        # Get job document
-        job_snapshot = job_ref.get(transaction=transaction)
+    def confirm_once():
+        # Get job credit flags only (job docs can be large)
+        job_snapshot = job_ref.get(field_paths=["creditsConfirmed", "creditsReserved", "pendingReserved"])
         if not job_snapshot.exists:
             raise ValueError("Job document not found")
         
@@ -209,39 +359,39 @@ def confirm_credit_deduction(
         if not job_data.get("creditsReserved"):
             raise ValueError("Credits were not reserved for this job")
         
-        # Get user document
-        user_snapshot = user_ref.get(transaction=transaction)
-        if not user_snapshot.exists:
-            raise ValueError("User document not found")
-        
-        user_data = user_snapshot.to_dict() or {}
-        is_pro = user_data.get("isPro", False)
-        
-        # Update user credits
-        updates: Dict[str, Any] = {
+        # Deduct from actual credits and remove from pending (jobs without
+        # pendingReserved predate the flag and were reserved here)
+        user_updates = {
             "totalVoicesGenerated": Increment(1),
+            "credits": Increment(-cost),
             "updatedAt": SERVER_TIMESTAMP
         }
-        
-        if True:  # Always deduct credits
-            # Deduct from actual credits and remove from pending
-            updates["credits"] = Increment(-cost)
-            updates["pendingCredits"] = Increment(-cost)
-        
-        transaction.update(user_ref, updates)
-        
-        # Mark credits as confirmed in job
-        transaction.update(job_ref, {
-            "creditsConfirmed": True,
-            "creditsConfirmedAt": SERVER_TIMESTAMP
-        })
+        if job_data.get("pendingReserved", True):
+            user_updates["pendingCredits"] = Increment(-cost)
+        
+        batch = db.batch()
+        batch.update(user_ref, user_updates)
+        
+        # Mark credits as confirmed in job, only if the flags are unchanged
+        batch.update(
+            job_ref,
+            {
+                "creditsConfirmed": True,
+                "creditsConfirmedAt": SERVER_TIMESTAMP
+            },
+            option=db.write_option(last_update_time=job_snapshot.update_time)
+        )
+        batch.commit()
         
         logger.info(f"✓ Confirmed {cost} credit deduction for user {uid}, job {job_id}")
         return True, None
     
     try:
-        transaction = db.transaction()
-        return update_in_transaction(transaction)
+        result = _retry_on_precondition(confirm_once, job_id)
+        if result[0]:
+            with _recent_jobs_lock:
+                _recent_confirmations[cache_key] = True
+        return result
     except ValueError as e:
         logger.warning(f"Credit confirmation failed for {uid}: {str(e)}")
         return False, str(e)
@@ -271,19 +421,15 @@ def release_credits(
     """
     logger.info(f"Releasing credits: uid={uid}, job_id={job_id}, cost={cost}, collection={collection_name}")
     
-    db = firestore.client()
+    db = get_db()
     user_ref = db.collection("users").document(uid)
     job_ref = db.collection(collection_name).document(job_id)
     
-    @transactional
-    def update_in_transaction(transaction):
-        # Get job document
-        try:
-            job_snapshot = job_ref.get(transaction=transaction)
-        except Exception:
-            job_snapshot = None
+    def release_once():
+        # Get job credit flags only (job docs can be large)
+        job_snapshot = job_ref.get(field_paths=["creditsConfirmed", "creditsReleased", "creditsReserved", "pendingReserved"])
         
-        if not job_snapshot or not job_snapshot.exists:
+        if not job_snapshot.exists:
             logger.warning(f"Job {job_id} not found, skipping credit release")
             return True, None
         
@@ -303,34 +449,34 @@ def release_credits(
             logger.warning(f"Credits were not reserved for job {job_id}")
             return True, None
         
-        # Get user document
-        user_snapshot = user_ref.get(transaction=transaction)
-        if not user_snapshot.exists:
-            raise ValueError("User document not found")
-        
-        user_data = user_snapshot.to_dict() or {}
-        is_pro = user_data.get("isPro", False)
-        
-        # Release credits
-        if True: # Always release credits if reserved
-            updates = {
+        batch = db.batch()
+        if job_data.get("pendingReserved", True):
+            batch.update(user_ref, {
                 "pendingCredits": Increment(-cost),
                 "updatedAt": SERVER_TIMESTAMP
-            }
-            transaction.update(user_ref, updates)
-        
-        # Mark credits as released in job
-        transaction.update(job_ref, {
-            "creditsReleased": True,
-            "creditsReleasedAt": SERVER_TIMESTAMP
-        })
+            })
+        
+        # Mark credits as released in job, only if the flags are unchanged
+        batch.update(
+            job_ref,
+            {
+                "creditsReleased": True,
+                "creditsReleasedAt": SERVER_TIMESTAMP
+            },
+            option=db.write_option(last_update_time=job_snapshot.update_time)
+        )
+        batch.commit()
         
         logger.info(f"✓ Released {cost} credits for user {uid}, job {job_id}")
         return True, None
     
     try:
-        transaction = db.transaction()
-        return update_in_transaction(transaction)
+        result = _retry_on_precondition(release_once, job_id)
+        if result[0]:
+            # Released jobs may be retried with the same ID
+            with _recent_jobs_lock:
+                _recent_reservations.pop((collection_name, job_id), None)
+        return result
     except ValueError as e:
         logger.warning(f"Credit release failed for {uid}: {str(e)}")
         return False, str(e)
@@ -341,7 +487,7 @@ def release_credits(
 
 def check_credits_available(uid: str, cost: int = 1) -> Tuple[bool, Optional[str]]:
     """Check if user has enough credits WITHOUT reserving them"""
-    db = firestore.client()
+    db = get_db()
     user_ref = db.collection("users").document(uid)
     
     try:
@@ -372,50 +518,232 @@ def check_credits_available(uid: str, cost: int = 1) -> Tuple[bool, Optional[str
         return False, f"Credit check failed: {str(e)}"
 
 
+def _expire_job(job_doc) -> bool:
+    """
+    Release credits for a single expired job and mark it expired.
+    Uses the transactional release_credits path.
+    
+    Returns:
+        True if the job was cleaned up, False otherwise
+    """
+    job_data = job_doc.to_dict() or {}
+    uid = job_data.get("uid")
+    cost = job_data.get("cost", 0)
+    
+    try:
+        success, error = release_credits(uid, job_doc.id, cost)
+        
+        if success:
+            # Update job as expired
+            job_doc.reference.update({
+                "status": "expired",
+                "error": "Job expired - credits released",
+                "updatedAt": SERVER_TIMESTAMP
+            })
+            logger.info(f"Cleaned up expired job {job_doc.id}")
+            return True
+        
+        logger.error(f"Failed to release credits for job {job_doc.id}: {error}")
+        return False
+        
+    except Exception as e:
+        logger.error(f"Error cleaning up job {job_doc.id}: {str(e)}")
+        return False
+
+
+def _expire_user_jobs_batch(db, user_ref, job_docs: list) -> Tuple[int, int]:
+    """
+    Release credits for all expired jobs of one user in a single WriteBatch.
+    
+    Each job update carries a last_update_time precondition, so the whole
+    batch fails (and nothing is written) if any job changed since it was read.
+    
+    Args:
+        db: Firestore client
+        user_ref: User document reference
+        job_docs: Expired job snapshots belonging to the user
+        
+    Returns:
+        Tuple of (cleaned_count, error_count)
+    """
+    batch = db.batch()
+    release_total = 0
+    cleaned_count = 0
+    error_count = 0
+    
+    for job_doc in job_docs:
+        job_data = job_doc.to_dict() or {}
+        
+        # If credits already confirmed, don't release
+        if job_data.get("creditsConfirmed"):
+            logger.error(f"Failed to release credits for job {job_doc.id}: Credits already confirmed")
+            error_count += 1
+            continue
+        
+        job_updates: Dict[str, Any] = {
+            "status": "expired",
+            "error": "Job expired - credits released",
+            "updatedAt": SERVER_TIMESTAMP
+        }
+        
+        if job_data.get("creditsReserved"):
+            if job_data.get("pendingReserved", True):
+                release_total += job_data.get("cost", 0)
+            job_updates["creditsReleased"] = True
+            job_updates["creditsReleasedAt"] = SERVER_TIMESTAMP
+        
+        batch.update(
+            job_doc.reference,
+            job_updates,
+            option=db.write_option(last_update_time=job_doc.update_time)
+        )
+        cleaned_count += 1
+    
+    if release_total:
+        batch.update(user_ref, {
+            "pendingCredits": Increment(-release_total),
+            "updatedAt": SERVER_TIMESTAMP
+        })
+    
+    if cleaned_count:
+        batch.commit()
+        logger.info(
+            f"Cleaned up {cleaned_count} expired jobs for user {user_ref.id}, "
+            f"released {release_total} credits"
+        )
+    
+    return cleaned_count, error_count
+
+
+def _cleanup_user_jobs(db, user_ref, job_docs: list) -> Tuple[int, int]:
+    """
+    Settle one user's expired jobs, batched first with a per-job fallback.
+    
+    Returns:
+        Tuple of (cleaned_count, error_count)
+    """
+    try:
+        return _expire_user_jobs_batch(db, user_ref, job_docs)
+    except Exception as e:
+        logger.warning(
+            f"Batched cleanup for user {user_ref.id} failed ({str(e)}), "
+            f"falling back to per-job transactions"
+        )
+    
+    cleaned_count = sum(1 for job_doc in job_docs if _expire_job(job_doc))
+    return cleaned_count, len(job_docs) - cleaned_count
+
+
+def _backfill_credits_released(db, now: datetime) -> int:
+    """
+    Set creditsReleased = False on expired reservations written before the
+    field was initialized at reservation time, so the cleanup query (an
+    equality filter, which never matches a missing field) can see them.
+    
+    Served by the (status, pendingCreditExpiry) index; each update is
+    preconditioned on the snapshot so a concurrent release is not undone.
+    
+    Returns:
+        Number of jobs backfilled
+    """
+    legacy_query = (
+        db.collection("voiceJobs")
+        .where("status", "in", ["queued", "processing"])
+        .where("pendingCreditExpiry", "<=", now)
+        .order_by("pendingCreditExpiry")
+        .limit(100)
+    )
+    
+    batch = db.batch()
+    backfilled = 0
+    for job_doc in legacy_query.stream():
+        job_data = job_doc.to_dict() or {}
+        if "creditsReleased" in job_data or not job_data.get("creditsReserved"):
+            continue
+        batch.update(
+            job_doc.reference,
+            {"creditsReleased": False},
+            option=db.write_option(last_update_time=job_doc.update_time)
+        )
+        backfilled += 1
+    
+    if backfilled:
+        try:
+            batch.commit()
+            logger.info(f"Backfilled creditsReleased on {backfilled} legacy expired jobs")
+        except FailedPrecondition:
+            # A job changed meanwhile; the next run picks the rest up
+            logger.info("Legacy job changed during creditsReleased backfill, retrying next run")
+            backfilled = 0
+    
+    return backfilled
+
+
 def cleanup_stale_pending_credits() -> Dict[str, Any]:
     """
     Cleanup function to release pending credits from expired jobs.
     Should be called periodically via Cloud Scheduler.
+    
+    Expired jobs are grouped by user and released with one batched write
+    per user, falling back to per-job transactions if a batch conflicts.
+    Users are settled concurrently on a bounded thread pool.
     """
-    db = firestore.client()
+    db = get_db()
     now = datetime.utcnow()
     
+    # Best effort: a failed backfill must not block the cleanup itself
+    try:
+        _backfill_credits_released(db, now)
+    except Exception as e:
+        logger.warning(f"creditsReleased backfill failed: {str(e)}")
+    
     # Find expired jobs with pending credits
     jobs_query = (
         db.collection("voiceJobs")
         .where("status", "in", ["queued", "processing"])
         .where("pendingCreditExpiry", "<=", now)
         .where("creditsReleased", "==", False)
+        .order_by("pendingCreditExpiry")
         .limit(100)
     )
     
     cleaned_count = 0
     error_count = 0
     
+    # Group expired jobs by owner
+    jobs_by_uid: Dict[str, list] = {}
     for job_doc in jobs_query.stream():
-        job_data = job_doc.to_dict()
-        uid = job_data.get("uid")
-        cost = job_data.get("cost", 0)
-        
-        try:
-            success, error = release_credits(uid, job_doc.id, cost)
-            
-            if success:
-                # Update job as expired
-                job_doc.reference.update({
-                    "status": "expired",
-                    "error": "Job expired - credits released",
-                    "updatedAt": SERVER_TIMESTAMP
-                })
-                cleaned_count += 1
-                logger.info(f"Cleaned up expired job {job_doc.id}")
-            else:
-                error_count += 1
-                logger.error(f"Failed to release credits for job {job_doc.id}: {error}")
-                
-        except Exception as e:
+        uid = (job_doc.to_dict() or {}).get("uid")
+        if not uid:
             error_count += 1
-            logger.error(f"Error cleaning up job {job_doc.id}: {str(e)}")
+            logger.error(f"Job {job_doc.id} has no uid, skipping cleanup")
+            continue
+        jobs_by_uid.setdefault(uid, []).append(job_doc)
+    
+    if jobs_by_uid:
+        user_refs = {uid: db.collection("users").document(uid) for uid in jobs_by_uid}
+        existing_users = {
+            snapshot.id for snapshot in db.get_all(list(user_refs.values()))
+            if snapshot.exists
+        }
+        
+        for uid, job_docs in list(jobs_by_uid.items()):
+            if uid not in existing_users:
+                error_count += len(job_docs)
+                logger.error(f"User {uid} document not found, skipping {len(job_docs)} expired jobs")
+                del jobs_by_uid[uid]
+        
+        # Settle users concurrently (Firestore RPCs release the GIL)
+        if jobs_by_uid:
+            max_workers = min(CLEANUP_MAX_WORKERS, len(jobs_by_uid))
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                results = executor.map(
+                    lambda item: _cleanup_user_jobs(db, user_refs[item[0]], item[1]),
+                    jobs_by_uid.items()
+                )
+                for cleaned, errors in results:
+                    cleaned_count += cleaned
+                    error_count += errors
     
     result = {
         "cleaned": cleaned_count,
@@ -424,4 +752,4 @@ def cleanup_stale_pending_credits() -> Dict[str, Any]:
     }
     
     logger.info(f"Pending credit cleanup complete: {result}")
-    return result
\ No newline at end of file
+    return result
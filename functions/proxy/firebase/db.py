@@ -3,16 +3,31 @@
 Centralized Firestore client with lazy initialization.
 Import this instead of firebase_admin.firestore in route files.
 """
+import threading
+
 import firebase_admin
 from firebase_admin import firestore, credentials
 
+_app = None
 _db_client = None
+_init_lock = threading.Lock()
 
-def _ensure_firebase_initialized():
-    """Ensure Firebase is initialized (lazy initialization)."""
-    if not firebase_admin._apps:
-        cred = credentials.ApplicationDefault()
-        firebase_admin.initialize_app(cred)
+def ensure_firebase_initialized():
+    """
+    Ensure Firebase is initialized (lazy initialization).
+    Shared by firebase.admin so the default app is set up in one place.
+    Guarded by a lock: concurrent first callers would otherwise both reach
+    initialize_app, and the second raises ValueError.
+    """
+    global _app
+    if _app is None:
+        with _init_lock:
+            if _app is None:
+                if firebase_admin._apps:
+                    _app = firebase_admin.get_app()
+                else:
+                    _app = firebase_admin.initialize_app(credentials.ApplicationDefault())
+    return _app
 
 def get_db():
     """
@@ -24,6 +39,8 @@ def get_db():
     """
     global _db_client
     if _db_client is None:
-        _ensure_firebase_initialized()  # Add this line
-        _db_client = firestore.client()
+        ensure_firebase_initialized()
+        with _init_lock:
+            if _db_client is None:
+                _db_client = firestore.client()
     return _db_client
\ No newline at end of file
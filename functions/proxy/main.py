@@ -4,7 +4,6 @@ Main entry point for Firebase Cloud Functions.
 Exports all route handlers for deployment.
 """
 
-import sys
 from dotenv import load_dotenv
 
 # Configure logging FIRST before any other imports
@@ -21,7 +20,6 @@ logger = get_logger(__name__)
 logger.info("=" * 80)
 logger.info("FIREBASE CLOUD FUNCTIONS INITIALIZING")
 logger.info("=" * 80)
-sys.stdout.flush()
 
 # Import all route handlers
 try:
@@ -33,6 +31,7 @@ try:
     from routes.dub_translate import dub_translate
     from routes.dub_clone import dub_clone
     from cleanup import cleanup_pending_credits
+    from voice_job_queue import enqueue_voice_job
     
     logger.info("✅ All modules loaded successfully")
     
@@ -47,8 +46,8 @@ __all__ = [
     'dub_transcribe',
     'dub_translate',
     'dub_clone',
-    'cleanup_pending_credits'
+    'cleanup_pending_credits',
+    'enqueue_voice_job'
 ]
 
-logger.info("🎉 Firebase Cloud Functions ready")
-sys.stdout.flush()
\ No newline at end of file
+logger.info("🎉 Firebase Cloud Functions ready")
\ No newline at end of file
@@ -4,242 +4,309 @@ Enhanced dubbing voice cloning route with multi-chunk processing
 and comprehensive error handling.
 """
 from firebase_functions import https_fn, options
-from flask import Request, jsonify, make_response, Response
+from flask import Request
+import io
 import logging
-import uuid
-from typing import List, Dict, Any, Optional
+import secrets
+from dataclasses import dataclass, field
+from typing import List, Dict, Any, Iterator, Optional
 from firebase.db import get_db
 
 from firebase.admin import get_current_user
-from utils import ResponseBuilder, MAX_SPEAKERS_PER_CHUNK
-from utils.task_helper import create_cloud_task
-from google.cloud.firestore import SERVER_TIMESTAMP
+from utils import ResponseBuilder, MAX_SPEAKERS_PER_CHUNK, CORS_HEADERS, CORS_PREFLIGHT_HEADERS, create_response, parse_json_body
+from utils.task_helper import create_batch_tasks, encode_chunk_payloads
+from google.api_core.exceptions import FailedPrecondition
+from google.cloud.firestore import transactional, SERVER_TIMESTAMP, DELETE_FIELD
 from utils.logging_config import get_logger, log_request
 
 logger = get_logger(__name__)
 
+# Chunks live in dubbingJobs/{jobId}/chunks/{chunkId}, so inference workers
+# update their own small document instead of rewriting an array on the job
+DUBBING_CHUNKS_COLLECTION = "chunks"
 
-def validate_clone_request(data: dict) -> tuple[bool, Optional[str]]:
+# Firestore rejects batches with more writes than this
+FIRESTORE_BATCH_LIMIT = 500
+
+# Only the fields dub_clone needs are read from the job (a field mask keeps
+# earlier outputs and other large fields off the wire)
+JOB_READ_FIELDS = ["uid", "transcript", "voiceMapping"]
+
+
+@transactional
+def mark_clone_failed(transaction, job_ref, run_id: str) -> bool:
     """
-    Validate voice clone request.
+    Mark a dubbing job failed if this run is still in the cloning state.
+    
+    Chunk workers may already have completed chunks (which bumps the job's
+    update_time), so the status and run ID are compared and swapped in one
+    transaction instead of relying on an update_time precondition. A newer
+    run of the same job is left alone.
     
-    Args:
-        data: Request data
-        
     Returns:
-        Tuple of (is_valid, error_message)
+        True if the job was marked failed
     """
-    job_id = data.get("jobId")
+    job_snapshot = job_ref.get(field_paths=["status", "cloneRunId"], transaction=transaction)
+    if not job_snapshot.exists:
+        return False
     
-    if not job_id:
-        return False, "Job ID is required"
+    job_data = job_snapshot.to_dict() or {}
+    if job_data.get("status") != "cloning" or job_data.get("cloneRunId") != run_id:
+        return False
     
-    return True, None
+    transaction.update(job_ref, {
+        "status": "failed",
+        "error": "Failed to queue voice cloning",
+        "updatedAt": SERVER_TIMESTAMP
+    })
+    return True
 
 
-
-def create_response(body: Any, status: int, headers: Dict[str, str]) -> Response:
-    """Create a Flask Response object with headers."""
-    response = jsonify(body) if isinstance(body, (dict, list)) else make_response(body)
-    response.status_code = status
-    for k, v in headers.items():
-        response.headers[k] = v
-    return response
+def _json_error(message: str, status: int, request_id: str):
+    """Build an error response with the shared module-level CORS headers."""
+    return create_response(ResponseBuilder.error(message, status, request_id=request_id), status, CORS_HEADERS)
 
 
 @https_fn.on_request(memory=options.MemoryOption.GB_1, timeout_sec=60, max_instances=10)
 def dub_clone(req: Request):
     """Start voice cloning for dubbing - uses character IDs."""
-    request_id = str(uuid.uuid4())
-    logger.info(f"[{request_id}] Dubbing clone request received")
-    
-    db = get_db()
-    
-    # CORS headers
-    cors_headers = {
-        "Content-Type": "application/json",
-        "Access-Control-Allow-Origin": "*"
-    }
-    
-    # CORS handling
+    # CORS preflight returns before any per-request setup
     if req.method == "OPTIONS":
-        options_headers = {
-            "Access-Control-Allow-Origin": "*",
-            "Access-Control-Allow-Methods": "POST, OPTIONS",
-            "Access-Control-Allow-Headers": "Authorization, Content-Type",
-        }
-        return create_response("", 204, options_headers)
-    
-    if req.method != "POST":
-        return create_response(ResponseBuilder.error("Method not allowed", request_id=request_id), 405, cors_headers)
-    
-    # Auth
-    user = get_current_user(req)
-    if not user or not user.get("uid"):
-        return create_response(ResponseBuilder.error("Unauthorized", request_id=request_id), 401, cors_headers)
+        return create_response("", 204, CORS_PREFLIGHT_HEADERS)
     
-    uid = user.get("uid")
-    if not uid:
-        logger.warning(f"[{request_id}] User missing UID")
-        return create_response(ResponseBuilder.error("Unauthorized", request_id=request_id), 401, cors_headers)
+    request_id = secrets.token_hex(16)
+    logger.info("[%s] Dubbing clone request received", request_id)
     
-    logger.info(f"[{request_id}] User authenticated: {uid}")
+    if req.method != "POST":
+        return _json_error("Method not allowed", 405, request_id)
     
-    # Parse request
+    # Parse request (cheap local checks run before token verification)
     try:
-        data = req.get_json(silent=True) or {}
+        data = parse_json_body(req) or {}
     except Exception as e:
-        return create_response(ResponseBuilder.error("Invalid JSON", request_id=request_id), 400, cors_headers)
+        return _json_error("Invalid JSON", 400, request_id)
     
     job_id = data.get("jobId")
     if not job_id:
-        return create_response(ResponseBuilder.error("Job ID is required", request_id=request_id), 400, cors_headers)
+        return _json_error("Job ID is required", 400, request_id)
+    
+    # Auth
+    uid = (get_current_user(req) or {}).get("uid")
+    if not uid:
+        return _json_error("Unauthorized", 401, request_id)
+    
+    logger.info("[%s] User authenticated: %s", request_id, uid)
+    
+    # Shared module-level client (firebase.db); first use on a cold instance
+    # sets up the channel, so preflight and rejected requests never touch it
+    db = get_db()
     
     # Get job
     try:
         job_ref = db.collection("dubbingJobs").document(job_id)
-        job_doc = job_ref.get()
+        job_doc = job_ref.get(field_paths=JOB_READ_FIELDS)
         
         if not job_doc.exists:
-            return create_response(ResponseBuilder.error("Job not found", request_id=request_id), 404, cors_headers)
+            return _json_error("Job not found", 404, request_id)
         
         job_data = job_doc.to_dict()
 
         if not job_data:
-            logger.error(f"[{request_id}] Job data is None for {job_id}")
-            return create_response(ResponseBuilder.error("Job data not found", request_id=request_id), 500, cors_headers)
+            logger.error("[%s] Job data is None for %s", request_id, job_id)
+            return _json_error("Job data not found", 500, request_id)
         
         if job_data.get("uid") != uid:
-            return create_response(ResponseBuilder.error("Unauthorized", request_id=request_id), 403, cors_headers)
+            return _json_error("Unauthorized", 403, request_id)
         
         transcript = job_data.get("transcript", [])
         voice_mapping = job_data.get("voiceMapping", {})
         
         if not transcript or not voice_mapping:
-            return create_response(ResponseBuilder.error("Incomplete job data", request_id=request_id), 400, cors_headers)
+            return _json_error("Incomplete job data", 400, request_id)
         
     except Exception as e:
-        logger.error(f"[{request_id}] Failed to get job: {str(e)}")
-        return create_response(ResponseBuilder.error("Failed to retrieve job", request_id=request_id), 500, cors_headers)
-    
-    # Use translated text if available
-    for segment in transcript:
-        segment["textToClone"] = segment.get("translatedText") or segment["text"]
+        logger.error("[%s] Failed to get job: %s", request_id, e)
+        return _json_error("Failed to retrieve job", 500, request_id)
     
-    # Chunk dialogue
-    chunks = chunk_dialogue_for_inference(transcript)
-    logger.info(f"[{request_id}] Job {job_id}: Split into {len(chunks)} chunks")
+    # Set once the cloning state is committed; only then is there anything
+    # for the failure rollback to undo
+    cloning_started = False
     
     # Build chunks with character IDs
     try:
+        # Resolve each speaker's voice once; chunks then only index the table
+        resolve_voice = resolve_voice_mapping(voice_mapping).get
         cloned_chunks = []
         
-        for chunk in chunks:
-            # Build text
-            chunk_text_parts = []
-            for segment in chunk["segments"]:
-                try:
-                    speaker_idx = chunk["speakers"].index(segment["speakerId"]) + 1
-                    chunk_text_parts.append(f"Speaker {speaker_idx}: {segment['textToClone']}")
-                except ValueError:
-                    continue
-            
-            # Build character IDs list (ordered by speaker)
-            chunk_character_ids = []
-            for speaker_id in chunk["speakers"]:
-                mapping = voice_mapping.get(speaker_id, {})
-                
-                if mapping.get("type") == "character":
-                    char_id = mapping.get("characterId")
-                    if char_id:
-                        chunk_character_ids.append(char_id)
-                    else:
-                        chunk_character_ids.append(None)  # Placeholder
-                elif mapping.get("type") == "original":
-                    # For original voices, store a special marker
-                    chunk_character_ids.append(f"original:{speaker_id}")
-                else:
-                    chunk_character_ids.append(None)
+        # Chunk documents are built as the chunker yields them (one pass also
+        # builds each chunk's speaker-tagged text), so only the Firestore
+        # dicts are held; task payloads (minimal) follow before any write
+        for chunk in chunk_dialogue_for_inference(transcript):
+            # Character IDs list (ordered by speaker)
+            chunk_character_ids = [resolve_voice(speaker_id) for speaker_id in chunk.speakers]
             
+            # Plain dicts only at the Firestore boundary
             cloned_chunks.append({
-                "chunkId": chunk["chunkId"],
-                "speakers": chunk["speakers"],
-                "text": "\n".join(chunk_text_parts),
+                "chunkId": chunk.chunk_id,
+                "speakers": chunk.speakers,
+                "text": chunk.text,
                 "characterIds": chunk_character_ids,
                 "audioUrl": None,
                 "status": "pending"
             })
         
-        # Update job with chunks
-        job_ref.update({
-            "status": "cloning",
-            "step": "Creating your custom voices...",
-            "progress": 75,
-            "totalChunks": len(chunks),
-            "completedChunks": 0,
-            "clonedAudioChunks": cloned_chunks,
-            "updatedAt": SERVER_TIMESTAMP
-        })
-        
-        # Queue tasks (minimal payload)
-        for chunk in chunks:
-            task_payload = {
-                "job_id": job_id,
-                "uid": uid,
-                "chunk_id": chunk["chunkId"]
-            }
-            
+        total_chunks = len(cloned_chunks)
+        logger.info("[%s] Job %s: Split into %d chunks", request_id, job_id, total_chunks)
+        
+        task_payloads = encode_chunk_payloads(job_id, uid, range(total_chunks))
+        
+        # Named per run (cloneRunId) and chunk, so a retried create_task is
+        # rejected as AlreadyExists instead of queuing a second GPU run
+        task_ids = [f"{job_id}-{request_id}-{chunk_id}" for chunk_id in range(total_chunks)]
+        
+        # The job update is the first write of the first batch, preconditioned
+        # on the snapshot read above, so the ownership check and the state
+        # transition commit atomically before any chunk document is touched.
+        # A concurrent request that loses the precondition writes nothing;
+        # chunks beyond the first batch follow in later batches.
+        try:
+            chunks_ref = job_ref.collection(DUBBING_CHUNKS_COLLECTION)
+            batch = db.batch()
+            batch.update(job_ref, {
+                "status": "cloning",
+                "step": "Creating your custom voices...",
+                "progress": 75,
+                "totalChunks": total_chunks,
+                "completedChunks": 0,
+                "clonedAudioChunks": DELETE_FIELD,
+                "cloneRunId": request_id,
+                "updatedAt": SERVER_TIMESTAMP
+            }, option=db.write_option(last_update_time=job_doc.update_time))
+            writes = 1
+            for cloned_chunk in cloned_chunks:
+                if writes == FIRESTORE_BATCH_LIMIT:
+                    batch.commit()
+                    cloning_started = True
+                    batch = db.batch()
+                    writes = 0
+                batch.set(chunks_ref.document(str(cloned_chunk["chunkId"])), cloned_chunk)
+                writes += 1
             
-            success, error = create_cloud_task(task_payload, endpoint="/inference")
-            if not success:
-                raise Exception(f"Failed to queue chunk {chunk['chunkId']}: {error}")
+            batch.commit()
+            cloning_started = True
+        except FailedPrecondition:
+            logger.warning("[%s] Job %s changed while starting cloning", request_id, job_id)
+            return _json_error("Job was modified, please retry", 409, request_id)
+        
+        # Queue tasks concurrently so latency does not grow with the number
+        # of chunks
+        _, failure_count, errors = create_batch_tasks(task_payloads, endpoint="/inference", task_ids=task_ids)
+        if failure_count:
+            raise Exception(f"Failed to queue {failure_count} of {total_chunks} chunks: {errors}")
         
         return create_response(ResponseBuilder.success({
             "jobId": job_id,
             "status": "cloning",
-            "totalChunks": len(chunks),
+            "totalChunks": total_chunks,
             "message": "Voice cloning started"
-        }, request_id=request_id), 202, cors_headers)
+        }, request_id=request_id), 202, CORS_HEADERS)
         
     except Exception as e:
-        logger.error(f"[{request_id}] Failed to queue tasks: {str(e)}")
-        job_ref.update({
-            "status": "failed",
-            "error": "Failed to queue voice cloning",
-            "updatedAt": SERVER_TIMESTAMP
-        })
-        return create_response(ResponseBuilder.error("Failed to queue cloning", request_id=request_id), 500, cors_headers)
-
-
-def chunk_dialogue_for_inference(transcript: List[Dict]) -> List[Dict[str, Any]]:
-    """Split transcript into chunks with max 4 speakers."""
-    chunks = []
-    current_chunk = {
-        "chunkId": 0,
-        "speakers": [],
-        "segments": []
-    }
+        logger.error("[%s] Failed to queue tasks: %s", request_id, e)
+        if cloning_started:
+            try:
+                if not mark_clone_failed(db.transaction(), job_ref, request_id):
+                    logger.info("[%s] Job %s already advanced, not marking failed", request_id, job_id)
+            except Exception as mark_error:
+                logger.error("[%s] Failed to mark job %s as failed: %s", request_id, job_id, mark_error)
+        return _json_error("Failed to queue cloning", 500, request_id)
+
+
+def resolve_voice_mapping(voice_mapping: Dict[str, Any]) -> Dict[str, Optional[str]]:
+    """
+    Map each speaker ID to its inference character ID.
+    
+    Character voices map to their characterId (None if unset) and original
+    voices to an "original:{speakerId}" marker; unmapped speakers are left
+    out, so lookups fall back to None.
+    """
+    resolved = {}
+    for speaker_id, mapping in voice_mapping.items():
+        mapping_type = (mapping or {}).get("type")
+        if mapping_type == "character":
+            resolved[speaker_id] = mapping.get("characterId") or None
+        elif mapping_type == "original":
+            # For original voices, store a special marker
+            resolved[speaker_id] = f"original:{speaker_id}"
+    return resolved
+
+
+# "Speaker N: " line prefixes, indexed by a speaker's position in its chunk
+_SPEAKER_LABELS = tuple(f"Speaker {i + 1}: " for i in range(MAX_SPEAKERS_PER_CHUNK))
+
+
+@dataclass(slots=True)
+class _DubChunk:
+    """One chunk of a dubbing transcript, as built by chunk_dialogue_for_inference."""
+    chunk_id: int
+    speakers: List[str] = field(default_factory=list)
+    text: str = ""
+
+
+def chunk_dialogue_for_inference(transcript: List[Dict]) -> Iterator[_DubChunk]:
+    """
+    Split transcript into chunks with max 4 speakers.
+    
+    Each chunk keeps its speakers in order and its text to clone, one
+    "Speaker N: ..." line per segment (translated text when available), so
+    the transcript is only walked once. Chunks are yielded as soon as they
+    are complete, with consecutive chunk IDs from 0.
+    """
+    chunk_count = 0
+    current_chunk = _DubChunk(chunk_id=0)
+    speaker_index: Dict[str, int] = {}
+    text_buffer = io.StringIO()
+    
+    # Fixed-size slots for the current chunk's speakers (at most
+    # MAX_SPEAKERS_PER_CHUNK); reused across chunks, each chunk keeps a slice
+    speaker_slots: List[Optional[str]] = [None] * MAX_SPEAKERS_PER_CHUNK
+    
+    # Hot-loop lookups bound to locals; rebound whenever a new chunk starts
+    get_speaker_idx = speaker_index.get
+    write = text_buffer.write
+    tell = text_buffer.tell
     
     for segment in transcript:
-        speaker_id = segment.get("speakerId")
+        get_field = segment.get
+        speaker_id = get_field("speakerId")
         if not speaker_id:
             continue
         
-        if speaker_id in current_chunk["speakers"]:
-            current_chunk["segments"].append(segment)
-        elif len(current_chunk["speakers"]) < MAX_SPEAKERS_PER_CHUNK:
-            current_chunk["speakers"].append(speaker_id)
-            current_chunk["segments"].append(segment)
-        else:
-            if current_chunk["segments"]:
-                chunks.append(current_chunk)
-            current_chunk = {
-                "chunkId": len(chunks),
-                "speakers": [speaker_id],
-                "segments": [segment]
-            }
-    
-    if current_chunk["segments"]:
-        chunks.append(current_chunk)
-    
-    return chunks
\ No newline at end of file
+        speaker_idx = get_speaker_idx(speaker_id)
+        if speaker_idx is None:
+            if len(speaker_index) >= MAX_SPEAKERS_PER_CHUNK:
+                current_chunk.speakers = speaker_slots[:]
+                current_chunk.text = text_buffer.getvalue()
+                yield current_chunk
+                chunk_count += 1
+                current_chunk = _DubChunk(chunk_id=chunk_count)
+                speaker_index = {}
+                text_buffer = io.StringIO()
+                get_speaker_idx = speaker_index.get
+                write = text_buffer.write
+                tell = text_buffer.tell
+            
+            speaker_idx = len(speaker_index)
+            speaker_index[speaker_id] = speaker_idx
+            speaker_slots[speaker_idx] = speaker_id
+        
+        # Lines are written straight into the chunk's buffer
+        if tell():
+            write("\n")
+        write(_SPEAKER_LABELS[speaker_idx])
+        write(get_field("translatedText") or segment["text"])
+    
+    if speaker_index:
+        current_chunk.speakers = speaker_slots[:len(speaker_index)]
+        current_chunk.text = text_buffer.getvalue()
+        yield current_chunk
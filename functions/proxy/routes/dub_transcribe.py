@@ -4,12 +4,13 @@ Enhanced dubbing transcription route with comprehensive validation,
 retry logic, and proper error handling.
 """
 from firebase_functions import https_fn, options
-from flask import Request, jsonify, make_response, Response
+from flask import Request
 import logging
 import os
+import secrets
 import uuid
-import base64
-from typing import Optional, Any, Dict
+import psutil
+from typing import Optional
 from datetime import datetime, timedelta
 from firebase.db import get_db
 from google.cloud.firestore import SERVER_TIMESTAMP
@@ -17,6 +18,10 @@ from google.cloud.firestore import SERVER_TIMESTAMP
 from firebase.admin import get_current_user
 from firebase.credits import reserve_credits, release_credits, calculate_dubbing_cost
 from utils import (
+    create_response,
+    parse_json_body,
+    CORS_HEADERS,
+    CORS_PREFLIGHT_HEADERS,
     UPLOAD_LIMITS,
     ResponseBuilder,
     GCSHelper,
@@ -91,15 +96,6 @@ def validate_dubbing_request(data: dict, user_tier: str) -> tuple[bool, Optional
 
 
 
-def create_response(body: Any, status: int, headers: Dict[str, str]) -> Response:
-    """Create a Flask Response object with headers."""
-    response = jsonify(body) if isinstance(body, (dict, list)) else make_response(body)
-    response.status_code = status
-    for k, v in headers.items():
-        response.headers[k] = v
-    return response
-
-
 @https_fn.on_request(memory=options.MemoryOption.GB_1, timeout_sec=120, max_instances=10)
 def dub_transcribe(req: Request):
     """
@@ -107,8 +103,11 @@ def dub_transcribe(req: Request):
     1. Generate signed URL for direct upload (action=get_upload_url)
     2. Start transcription for uploaded media (default action)
     """
-    request_id = str(uuid.uuid4())
-    import psutil
+    # CORS preflight returns before any per-request setup
+    if req.method == "OPTIONS":
+        return create_response("", 204, CORS_PREFLIGHT_HEADERS)
+    
+    request_id = secrets.token_hex(16)
     process = psutil.Process(os.getpid())
     memory_info = process.memory_info().rss / (1024 * 1024)
     logger.info(f"[{request_id}] Handle start: Action={req.args.get('action')}, Memory={memory_info:.1f}MB")
@@ -116,19 +115,7 @@ def dub_transcribe(req: Request):
     db = get_db()
     gcs = GCSHelper(GCS_DUBBING_BUCKET)
     
-    cors_headers = {
-        "Content-Type": "application/json",
-        "Access-Control-Allow-Origin": "*"
-    }
-    
-    # CORS
-    if req.method == "OPTIONS":
-        options_headers = {
-            "Access-Control-Allow-Origin": "*",
-            "Access-Control-Allow-Methods": "POST, OPTIONS",
-            "Access-Control-Allow-Headers": "Authorization, Content-Type",
-        }
-        return create_response("", 204, options_headers)
+    cors_headers = CORS_HEADERS
     
     if req.method != "POST":
         return create_response(ResponseBuilder.error("Method not allowed", request_id=request_id), 405, cors_headers)
@@ -144,7 +131,7 @@ def dub_transcribe(req: Request):
     action = req.args.get("action")
     if action == "get_upload_url":
         try:
-            data = req.get_json(silent=True) or {}
+            data = parse_json_body(req) or {}
             file_name = sanitize_filename(data.get("fileName", "media"))
             content_type = data.get("contentType", "application/octet-stream")
             
@@ -167,7 +154,7 @@ def dub_transcribe(req: Request):
 
     # Standard Transcription Flow
     try:
-        data = req.get_json(silent=True) or {}
+        data = parse_json_body(req) or {}
     except Exception as e:
         return create_response(ResponseBuilder.error("Invalid JSON", request_id=request_id), 400, cors_headers)
     
@@ -3,15 +3,15 @@
 Enhanced dubbing translation route with validation and error handling.
 """
 from firebase_functions import https_fn, options
-from flask import Request, jsonify, make_response, Response
+from flask import Request
 import logging
-import uuid
-from typing import Optional, Any, Dict
+import secrets
+from typing import Optional
 from firebase.db import get_db
 from google.cloud.firestore import SERVER_TIMESTAMP
 
 from firebase.admin import get_current_user
-from utils import ResponseBuilder
+from utils import ResponseBuilder, CORS_HEADERS, CORS_PREFLIGHT_HEADERS, create_response, parse_json_body
 from utils.task_helper import create_cloud_task
 from utils.logging_config import get_logger, log_request
 
@@ -63,40 +63,23 @@ def validate_translation_request(data: dict) -> tuple[bool, Optional[str]]:
 
 
 
-def create_response(body: Any, status: int, headers: Dict[str, str]) -> Response:
-    """Create a Flask Response object with headers."""
-    response = jsonify(body) if isinstance(body, (dict, list)) else make_response(body)
-    response.status_code = status
-    for k, v in headers.items():
-        response.headers[k] = v
-    return response
-
-
 @https_fn.on_request(memory=options.MemoryOption.GB_1, timeout_sec=60, max_instances=10)
 def dub_translate(req: Request):
     """
     Start translation for dubbing job.
     Translates transcript segments to target language.
     """
-    request_id = str(uuid.uuid4())
+    # CORS preflight returns before any per-request setup
+    if req.method == "OPTIONS":
+        return create_response("", 204, CORS_PREFLIGHT_HEADERS)
+    
+    request_id = secrets.token_hex(16)
     logger.info(f"[{request_id}] Dubbing translate request received")
 
     db = get_db()
     
     # CORS headers
-    cors_headers = {
-        "Content-Type": "application/json",
-        "Access-Control-Allow-Origin": "*"
-    }
-    
-    # CORS
-    if req.method == "OPTIONS":
-        options_headers = {
-            "Access-Control-Allow-Origin": "*",
-            "Access-Control-Allow-Methods": "POST, OPTIONS",
-            "Access-Control-Allow-Headers": "Authorization, Content-Type",
-        }
-        return create_response("", 204, options_headers)
+    cors_headers = CORS_HEADERS
     
     if req.method != "POST":
         return create_response(ResponseBuilder.error("Method not allowed", request_id=request_id), 405, cors_headers)
@@ -112,7 +95,7 @@ def dub_translate(req: Request):
     
     # Parse request
     try:
-        data = req.get_json(silent=True) or {}
+        data = parse_json_body(req) or {}
     except Exception as e:
         logger.error(f"[{request_id}] JSON parse error: {str(e)}")
         return create_response(ResponseBuilder.error("Invalid JSON", request_id=request_id), 400, cors_headers)
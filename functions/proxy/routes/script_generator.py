@@ -3,14 +3,13 @@ Enhanced AI Script Generator using Google GenAI SDK (2025).
 Uses the new google-genai package with Gemini 2.5 models.
 """
 from firebase_functions import https_fn, options
-from flask import Request, jsonify, make_response, Response
+from flask import Request
 import os
+import secrets
 import uuid
 import time
-from typing import List, Dict, Any, Tuple
+from typing import TYPE_CHECKING, List, Dict, Any, Tuple
 
-from google import genai
-from google.genai import types
 from firebase.db import get_db
 from google.cloud.firestore import SERVER_TIMESTAMP
 from firebase.admin import get_current_user
@@ -20,8 +19,12 @@ from firebase.credits import (
     reserve_credits, 
     release_credits
 )
+from utils import CORS_HEADERS, CORS_PREFLIGHT_HEADERS, create_response, parse_json_body
 from utils.logging_config import get_logger
 
+if TYPE_CHECKING:
+    from google import genai
+
 logger = get_logger(__name__)
 
 # Configuration
@@ -32,10 +35,11 @@ MAX_CHARACTERS = 10
 RATE_LIMIT_WINDOW = 60
 MAX_REQUESTS_PER_WINDOW = 10
 
-def _get_gemini_client() -> genai.Client:
-    """Get configured Gemini client using the new SDK."""
+def _get_gemini_client() -> "genai.Client":
+    """Get configured Gemini client using the new SDK (imported on first use)."""
     if not GEMINI_API_KEY:
         raise ValueError("GEMINI_API_KEY not configured")
+    from google import genai
     return genai.Client(api_key=GEMINI_API_KEY)
 
 
@@ -102,15 +106,6 @@ def validate_script_request(data: dict) -> Tuple[bool, str]:
 
 
 
-def create_response(body: Any, status: int, headers: Dict[str, str]) -> Response:
-    """Create a Flask Response object with headers."""
-    response = jsonify(body) if isinstance(body, (dict, list)) else make_response(body)
-    response.status_code = status
-    for k, v in headers.items():
-        response.headers[k] = v
-    return response
-
-
 @https_fn.on_request(
     memory=options.MemoryOption.GB_1,
     timeout_sec=60,
@@ -118,23 +113,15 @@ def create_response(body: Any, status: int, headers: Dict[str, str]) -> Response
 )
 def generate_script(req: Request):
     """Generate AI script using Gemini 2.5."""
-    request_id = str(uuid.uuid4())
+    # CORS preflight returns before any per-request setup
+    if req.method == "OPTIONS":
+        return create_response("", 204, CORS_PREFLIGHT_HEADERS)
+    
+    request_id = secrets.token_hex(16)
     logger.info(f"[{request_id}] Script generation request received")
     
     # CORS headers
-    cors_headers = {
-        "Content-Type": "application/json",
-        "Access-Control-Allow-Origin": "*"
-    }
-    
-    # Handle OPTIONS (CORS preflight)
-    if req.method == "OPTIONS":
-        options_headers = {
-            "Access-Control-Allow-Origin": "*",
-            "Access-Control-Allow-Methods": "POST, OPTIONS",
-            "Access-Control-Allow-Headers": "Authorization, Content-Type",
-        }
-        return create_response("", 204, options_headers)
+    cors_headers = CORS_HEADERS
     
     if req.method != "POST":
         return create_response({"error": "Method not allowed"}, 405, cors_headers)
@@ -161,7 +148,7 @@ def generate_script(req: Request):
     
     # Parse request
     try:
-        data = req.get_json(silent=True) or {}
+        data = parse_json_body(req) or {}
     except Exception as e:
         logger.error(f"[{request_id}] JSON parse error: {str(e)}")
         return create_response({"error": "Invalid JSON"}, 400, cors_headers)
@@ -224,6 +211,8 @@ def generate_script(req: Request):
     
     # Call Gemini using new SDK
     try:
+        from google.genai import types
+        
         # Use Gemini 2.5 Flash for best quality and speed
         response = client.models.generate_content(
             model='gemini-2.5-flash',
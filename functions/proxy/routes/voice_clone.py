@@ -1,47 +1,104 @@
 from firebase_functions import https_fn, options
-from flask import Request, jsonify, make_response, Response
-import sys
-import uuid
-from typing import List, Dict, Any, Optional
+from flask import Request
+import json
+import re
+import secrets
+import threading
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import List, Dict, Any, Optional, Sequence, Tuple
 from firebase.db import get_db
-from google.cloud.firestore import SERVER_TIMESTAMP
+from cachetools import TTLCache
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 from firebase.admin import get_current_user
-from firebase.credits import reserve_credits, release_credits, calculate_cost_from_duration
+from firebase.credits import reserve_credits, calculate_cost_from_duration
 from utils import (
+    create_response,
+    parse_json_body,
+    CORS_HEADERS,
+    CORS_PREFLIGHT_HEADERS,
     MAX_TEXT_LENGTH,
+    MAX_VOICE_SAMPLES,
     MAX_SPEAKERS_PER_CHUNK,
     SECONDS_PER_SPEAKER_ESTIMATE,
     SPEAKER_LIMITS,
     ResponseBuilder,
 )
-from utils.task_helper import create_cloud_task
-from utils.logging_config import get_logger, log_request
+from utils.logging_config import get_logger
 
 logger = get_logger(__name__)
 
-# ✅ Log module load
-print("voice_clone.py module loaded")
-sys.stdout.flush()
+# Per-instance user tier cache; tier changes are picked up within the TTL
+USER_TIER_CACHE_TTL_SECONDS = 60
+USER_TIER_CACHE_MAX_SIZE = 2048
+_user_tier_cache: TTLCache = TTLCache(maxsize=USER_TIER_CACHE_MAX_SIZE, ttl=USER_TIER_CACHE_TTL_SECONDS)
+_user_tier_cache_lock = threading.Lock()
+
+# Request body cap, checked before any Firestore work. The job document
+# stores the text up to twice (full text plus per-chunk text), so this keeps
+# it well under Firestore's 1 MiB document limit.
+MAX_REQUEST_BODY_BYTES = 400_000
+
+# Cost of the common single-speaker request (depends only on constants)
+_SINGLE_SPEAKER_COST = calculate_cost_from_duration(SECONDS_PER_SPEAKER_ESTIMATE, False)
+
+# Any path ending in this is answered as a health check
+HEALTH_PATH_SUFFIX = "/health"
+
+# Health check body never changes, so it is serialized once per instance
+_health_payload = ResponseBuilder.success({"status": "healthy"})
+if orjson is not None:
+    _HEALTH_BODY = orjson.dumps(_health_payload)
+else:
+    _HEALTH_BODY = json.dumps(_health_payload).encode()
+
+# Memoized dialogue analysis (users often resubmit the same script); long
+# scripts bypass the cache to bound per-instance memory
+DIALOGUE_CACHE_SIZE = 256
+DIALOGUE_CACHE_MAX_TEXT_LENGTH = 20_000
+
+# "Speaker: dialogue" lines; the label runs up to the first colon and both
+# groups exclude surrounding whitespace
+_SPEAKER_LINE_RE = re.compile(r'^[^\S\n]*([^:\n]*?)[^\S\n]*:[^\S\n]*(.*?)[^\S\n]*$', re.MULTILINE)
 
 
 def validate_voice_clone_request(data: dict) -> tuple[bool, Optional[str]]:
-    """Validate voice clone request with character IDs."""
-    text = data.get("text", "").strip()
-    character_ids = data.get("character_ids", [])
+    """
+    Validate voice clone request with character IDs.
+    Types and length bounds are checked before any work over the text.
+    """
+    if not isinstance(data, dict):
+        return False, "Request body must be a JSON object"
     
-    if not text:
-        return False, "Text is required"
+    text = data.get("text", "")
+    character_ids = data.get("character_ids") or ()
     
-    if not character_ids:
-        return False, "Character IDs are required"
+    if not isinstance(text, str):
+        return False, "Text must be a string"
     
     if len(text) > MAX_TEXT_LENGTH:
         return False, f"Text exceeds maximum length of {MAX_TEXT_LENGTH} characters"
     
+    if not text.strip():
+        return False, "Text is required"
+    
+    if not character_ids:
+        return False, "Character IDs are required"
+    
     if not isinstance(character_ids, list):
         return False, "Character IDs must be an array"
     
+    if not isinstance(data.get("character_texts") or (), (list, tuple)):
+        return False, "Character texts must be an array"
+    
+    if len(character_ids) > MAX_VOICE_SAMPLES:
+        return False, f"Too many character IDs (max {MAX_VOICE_SAMPLES})"
+    
     for idx, char_id in enumerate(character_ids):
         if not isinstance(char_id, str) or len(char_id) == 0:
             return False, f"Invalid character ID at index {idx}"
@@ -49,122 +106,128 @@ def validate_voice_clone_request(data: dict) -> tuple[bool, Optional[str]]:
     return True, None
 
 
-def chunk_multi_speaker_dialogue(
+@dataclass(slots=True)
+class _DialogueChunk:
+    """Working buffer for one chunk while analyze_dialogue scans the text."""
+    speakers: List[str] = field(default_factory=list)
+    lines: List[str] = field(default_factory=list)
+    character_indices: List[int] = field(default_factory=list)
+
+
+def _dialogue_line(text: str, match: re.Match) -> str:
+    """Reuse the source line when it is already "label: dialogue", else normalize it."""
+    label_end = match.end(1)
+    if match.start(2) - label_end == 2 and text.startswith(': ', label_end):
+        return text[match.start(1):match.end(2)]
+    return f"{match.group(1)}: {match.group(2)}"
+
+
+def analyze_dialogue(
     text: str, 
     character_ids: List[str], 
     max_speakers: int = MAX_SPEAKERS_PER_CHUNK
-) -> List[Dict[str, Any]]:
+) -> Tuple[int, List[Dict[str, Any]]]:
     """
-    Split multi-speaker dialogue into chunks.
-    Now stores character IDs instead of voice samples.
+    Count unique speakers and split multi-speaker dialogue into chunks
+    in a single pass over the text.
+    Chunks store character IDs instead of voice samples.
+    
+    Returns:
+        Tuple of (unique_speaker_count, chunks)
     """
-    lines = text.strip().split('\n')
+    if len(text) > DIALOGUE_CACHE_MAX_TEXT_LENGTH:
+        return _analyze_dialogue(text, character_ids, max_speakers)
+    
+    speaker_count, chunks = _analyze_dialogue_cached(text, tuple(character_ids), max_speakers)
+    
+    # Hand out copies so callers cannot mutate the cached plan
+    return speaker_count, [
+        {
+            'speakers': list(chunk['speakers']),
+            'text': chunk['text'],
+            'characterIds': list(chunk['characterIds']),
+        }
+        for chunk in chunks
+    ]
+
+
+def _analyze_dialogue(
+    text: str, 
+    character_ids: Sequence[str], 
+    max_speakers: int
+) -> Tuple[int, List[Dict[str, Any]]]:
+    """Uncached implementation of analyze_dialogue."""
+    speakers = set()
     chunks = []
-    current_chunk: Dict[str, Any] = {
-        'speakers': [],
-        'lines': [],
-        'character_indices': []
-    }
+    current_chunk = _DialogueChunk()
     
     speaker_to_char_idx = {}
     
-    for line in lines:
-        if ':' not in line:
+    def finish_chunk(chunk: _DialogueChunk) -> None:
+        chunks.append({
+            'speakers': chunk.speakers,
+            'text': '\n'.join(chunk.lines),
+            'characterIds': [
+                character_ids[idx] for idx in chunk.character_indices
+                if idx < len(character_ids)
+            ],
+        })
+    
+    for match in _SPEAKER_LINE_RE.finditer(text):
+        speaker_label, dialogue = match.group(1, 2)
+        if not speaker_label:
             continue
-            
-        speaker_label, dialogue = line.split(':', 1)
-        speaker_label = speaker_label.strip()
-        dialogue = dialogue.strip()
+        speakers.add(speaker_label)
         
-        if not speaker_label or not dialogue:
+        if not dialogue:
             continue
         
         if speaker_label not in speaker_to_char_idx:
             speaker_to_char_idx[speaker_label] = len(speaker_to_char_idx)
         
         char_idx = speaker_to_char_idx[speaker_label]
+        line = _dialogue_line(text, match)
         
-        if speaker_label in current_chunk['speakers']:
-            current_chunk['lines'].append(f"{speaker_label}: {dialogue}")
-        elif len(current_chunk['speakers']) < max_speakers:
-            current_chunk['speakers'].append(speaker_label)
-            current_chunk['character_indices'].append(char_idx)
-            current_chunk['lines'].append(f"{speaker_label}: {dialogue}")
+        if speaker_label in current_chunk.speakers:
+            current_chunk.lines.append(line)
+        elif len(current_chunk.speakers) < max_speakers:
+            current_chunk.speakers.append(speaker_label)
+            current_chunk.character_indices.append(char_idx)
+            current_chunk.lines.append(line)
         else:
-            if current_chunk['lines']:
-                current_chunk['text'] = '\n'.join(current_chunk['lines'])
-                current_chunk['characterIds'] = [
-                    character_ids[idx] for idx in current_chunk['character_indices']
-                    if idx < len(character_ids)
-                ]
-                chunks.append(current_chunk)
+            if current_chunk.lines:
+                finish_chunk(current_chunk)
             
-            current_chunk = {
-                'speakers': [speaker_label],
-                'lines': [f"{speaker_label}: {dialogue}"],
-                'character_indices': [char_idx]
-            }
-    
-    if current_chunk['lines']:
-        current_chunk['text'] = '\n'.join(current_chunk['lines'])
-        current_chunk['characterIds'] = [
-            character_ids[idx] for idx in current_chunk['character_indices']
-            if idx < len(character_ids)
-        ]
-        chunks.append(current_chunk)
-    
-    return chunks
+            current_chunk = _DialogueChunk([speaker_label], [line], [char_idx])
+    
+    if current_chunk.lines:
+        finish_chunk(current_chunk)
+    
+    return len(speakers), chunks
 
 
+_analyze_dialogue_cached = lru_cache(maxsize=DIALOGUE_CACHE_SIZE)(_analyze_dialogue)
 
-def create_response(body: Any, status: int, headers: Dict[str, str]) -> Response:
-    """Create a Flask Response object with headers."""
-    response = jsonify(body) if isinstance(body, (dict, list)) else make_response(body)
-    response.status_code = status
-    for k, v in headers.items():
-        response.headers[k] = v
-    return response
 
 
 @https_fn.on_request(memory=options.MemoryOption.GB_1, timeout_sec=60, max_instances=10)
 def voice_clone(req: Request):
     """Voice cloning endpoint - now uses character IDs."""
-    request_id = str(uuid.uuid4())
-    
-    # ✅ CRITICAL: Force immediate output to verify function is called
-    print("=" * 100)
-    print(f"VOICE_CLONE FUNCTION CALLED - Request ID: {request_id}")
-    print(f"Method: {req.method}")
-    print(f"Path: {req.path}")
-    print(f"Headers: {dict(req.headers)}")
-    print("=" * 100)
-    sys.stdout.flush()
+    # Health checks (probes) skip request logging and ID generation;
+    # "/health" itself also ends with the suffix
+    if req.path.endswith(HEALTH_PATH_SUFFIX):
+        return create_response(_HEALTH_BODY, 200, CORS_HEADERS)
     
-    # Log request details
-    log_request(logger, request_id, req.method, req.path, dict(req.headers))
-    logger.info(f"[{request_id}] Voice clone request received")
-    sys.stdout.flush()
+    # CORS preflight returns before any per-request setup
+    if req.method == "OPTIONS":
+        return create_response("", 204, CORS_PREFLIGHT_HEADERS)
     
-    db = get_db()
+    # Only state changes are logged on the happy path (one line per accepted
+    # job), with %-style arguments so skipped records are never formatted
+    request_id = secrets.token_hex(16)
     
     # CORS headers to use in all responses
-    cors_headers = {
-        "Content-Type": "application/json",
-        "Access-Control-Allow-Origin": "*"
-    }
-    
-    # Health check handling
-    if req.path == "/health" or req.path.endswith("/health"):
-        return create_response(ResponseBuilder.success({"status": "healthy"}), 200, cors_headers)
-    
-    # OPTIONS request for CORS
-    if req.method == "OPTIONS":
-        options_headers = {
-            "Access-Control-Allow-Origin": "*",
-            "Access-Control-Allow-Methods": "POST, OPTIONS",
-            "Access-Control-Allow-Headers": "Authorization, Content-Type",
-        }
-        return create_response("", 204, options_headers)
+    cors_headers = CORS_HEADERS
     
     # Only allow POST
     if req.method != "POST":
@@ -177,22 +240,29 @@ def voice_clone(req: Request):
     
     uid = user.get("uid")
     if not uid:
-        logger.warning(f"[{request_id}] User missing UID")
+        logger.warning("[%s] User missing UID", request_id)
         return create_response(ResponseBuilder.error("Unauthorized", request_id=request_id), 401, cors_headers)
     
-    logger.info(f"[{request_id}] User authenticated: {uid}")
+    # Reject oversized bodies before reading the user tier or reserving credits
+    body_size = req.content_length if req.content_length is not None else len(req.get_data())
+    if body_size > MAX_REQUEST_BODY_BYTES:
+        return create_response(ResponseBuilder.error(
+            f"Request body exceeds maximum size of {MAX_REQUEST_BODY_BYTES} bytes",
+            request_id=request_id
+        ), 413, cors_headers)
     
-    # Get user tier
-    user_doc = db.collection("users").document(uid).get()
-    user_data = user_doc.to_dict() if user_doc.exists else {}
-    user_tier = get_user_tier(user_data)
+    # Get user tier; a "tier" custom claim on the verified token avoids the
+    # user document lookup entirely
+    user_tier = user.get("tier")
+    if user_tier not in SPEAKER_LIMITS:
+        user_tier = get_cached_user_tier(get_db(), uid)
     max_speakers = SPEAKER_LIMITS[user_tier]
     
     # Parse request
     try:
-        data = req.get_json(silent=True) or {}
+        data = parse_json_body(req) or {}
     except Exception as e:
-        logger.error(f"[{request_id}] JSON parse error: {str(e)}")
+        logger.error("[%s] JSON parse error: %s", request_id, e)
         return create_response(ResponseBuilder.error("Invalid JSON", request_id=request_id), 400, cors_headers)
     
     # Validate request
@@ -200,13 +270,16 @@ def voice_clone(req: Request):
     if not is_valid:
         return create_response(ResponseBuilder.error(error_msg or "Validation failed", request_id=request_id), 400, cors_headers)
     
+    # Validated above: text is a string and character_ids a non-empty list
     text = data.get("text", "").strip()
-    character_ids = data.get("character_ids", [])
-    character_texts = data.get("character_texts")
+    character_ids = data["character_ids"]
+    character_texts = data.get("character_texts") or None
     
-    # Count speakers
-    speaker_count = count_speakers_in_text(text) if character_texts else 1
-    logger.info(f"[{request_id}] Detected {speaker_count} speakers")
+    # Count speakers (and plan chunks in the same pass)
+    if character_texts:
+        speaker_count, dialogue_chunks = analyze_dialogue(text, character_ids, MAX_SPEAKERS_PER_CHUNK)
+    else:
+        speaker_count, dialogue_chunks = 1, []
     
     # Validate speaker limit
     if speaker_count > max_speakers:
@@ -215,111 +288,77 @@ def voice_clone(req: Request):
             request_id=request_id
         ), 400, cors_headers)
     
+    # Every speaker with dialogue needs a character ID; otherwise the job
+    # would be charged and then fail in inference with a missing voice
+    if any(len(chunk['characterIds']) < len(chunk['speakers']) for chunk in dialogue_chunks):
+        return create_response(ResponseBuilder.error(
+            "Not enough character IDs for the speakers in the dialogue",
+            request_id=request_id
+        ), 400, cors_headers)
+    
     # Calculate cost and create job
     estimated_duration = speaker_count * SECONDS_PER_SPEAKER_ESTIMATE
-    cost = calculate_cost_from_duration(estimated_duration, speaker_count > 1)
-    job_id = str(uuid.uuid4())
+    if speaker_count == 1:
+        cost = _SINGLE_SPEAKER_COST
+    else:
+        cost = calculate_cost_from_duration(estimated_duration, speaker_count > 1)
+    job_id = secrets.token_hex(16)
+    
+    # Handle chunking
+    needs_chunking = speaker_count > MAX_SPEAKERS_PER_CHUNK
+    chunks = []
     
     # ✅ IMPORTANT: reserve_credits() creates the job document atomically
     # We pass job metadata so it can create the document in the same transaction
     job_metadata = {
-        "text": data.get("text", ""),
-        "character_texts": data.get("character_texts"),
+        "text": text,
+        "character_texts": character_texts,
         "estimatedDuration": estimated_duration,
         "speakerCount": speaker_count,
     }
     
+    if needs_chunking:
+        chunks = dialogue_chunks
+        job_metadata.update({
+            "totalChunks": len(chunks),
+            "completedChunks": 0,
+            "chunks": [
+                {
+                    "chunkId": i,
+                    "text": chunk['text'],
+                    "characterIds": chunk['characterIds'],
+                    "speakers": chunk['speakers'],
+                    "status": "pending"
+                }
+                for i, chunk in enumerate(chunks)
+            ]
+        })
+    else:
+        # Single chunk - store text AND character IDs
+        job_metadata["characterIds"] = character_ids
+    
     # Reserve credits - this also creates the job document atomically
     try:
-        logger.info(f"[{request_id}] Attempting to reserve {cost} credits for user {uid}")
         success, error_msg = reserve_credits(uid, job_id, cost, job_metadata)
         
-        logger.info(f"[{request_id}] Credit reservation result: success={success}, error={error_msg}")
-        
         if not success:
-            logger.error(f"[{request_id}] Credit reservation FAILED - returning 402 error")
-            sys.stdout.flush()
+            logger.warning("[%s] Credit reservation failed for %s: %s", request_id, uid, error_msg)
             return create_response(ResponseBuilder.error(
                 error_msg or "Credit reservation failed", 
                 request_id=request_id
             ), 402, cors_headers)
         
-        logger.info(f"[{request_id}] Credit reservation SUCCESS - job document created atomically")
-        
     except Exception as e:
-        logger.error(f"[{request_id}] Credit reservation exception: {str(e)}")
-        sys.stdout.flush()
+        logger.error("[%s] Credit reservation exception: %s", request_id, e)
         return create_response(ResponseBuilder.error("Credit reservation failed", request_id=request_id), 500, cors_headers)
     
-    # Get job reference (already created by reserve_credits)
-    job_ref = db.collection("voiceJobs").document(job_id)
-    
-    # Handle chunking
-    needs_chunking = speaker_count > MAX_SPEAKERS_PER_CHUNK
-    chunks = []
-    
-    if needs_chunking:
-        chunks = chunk_multi_speaker_dialogue(text, character_ids, MAX_SPEAKERS_PER_CHUNK)
-        logger.info(f"[{request_id}] Split into {len(chunks)} chunks")
-        
-        try:
-            job_ref.update({
-                "totalChunks": len(chunks),
-                "completedChunks": 0,
-                "chunks": [
-                    {
-                        "chunkId": i,
-                        "text": chunk['text'],
-                        "characterIds": chunk['characterIds'],
-                        "speakers": chunk['speakers'],
-                        "status": "pending"
-                    }
-                    for i, chunk in enumerate(chunks)
-                ]
-            })
-        except Exception as e:
-            logger.error(f"[{request_id}] Failed to update job: {str(e)}")
-            release_credits(uid, job_id, cost)
-            return create_response(ResponseBuilder.error("Failed to create job", request_id=request_id), 500, cors_headers)
-        
-        # Queue chunks (minimal payload)
-        for i in range(len(chunks)):
-            task_payload = {
-                "job_id": job_id,
-                "uid": uid,
-                "chunk_id": i
-            }
-            
-            success, error = create_cloud_task(task_payload, endpoint="/inference")
-            if not success:
-                logger.error(f"[{request_id}] Failed to queue chunk {i}: {error}")
-                release_credits(uid, job_id, cost)
-                return create_response(ResponseBuilder.error("Failed to queue task", request_id=request_id), 500, cors_headers)
-    
-    else:
-        # Single chunk - store text AND character IDs
-        try:
-            job_ref.update({
-                "text": text,
-                "characterIds": character_ids
-            })
-        except Exception as e:
-            logger.error(f"[{request_id}] Failed to update job: {str(e)}")
-            release_credits(uid, job_id, cost)
-            return create_response(ResponseBuilder.error("Failed to store job data", request_id=request_id), 500, cors_headers)
-        
-        task_payload = {
-            "job_id": job_id,
-            "uid": uid
-        }
-        
-        success, error = create_cloud_task(task_payload, endpoint="/inference")
-        if not success:
-            logger.error(f"[{request_id}] Failed to queue task: {error}")
-            release_credits(uid, job_id, cost)
-            return create_response(ResponseBuilder.error("Failed to queue task", request_id=request_id), 500, cors_headers)
-    
-    logger.info(f"[{request_id}] Job {job_id} queued successfully")
+    # Inference tasks are queued by the enqueue_voice_job Firestore trigger
+    # when the job document lands; the client follows progress (or failure)
+    # through the job document
+    logger.info(
+        "[%s] Job %s accepted: uid=%s speakers=%d chunks=%d cost=%d",
+        request_id, job_id, uid, speaker_count, len(chunks) if needs_chunking else 1, cost
+    )
     
     return create_response(ResponseBuilder.success({
         "jobId": job_id,
@@ -342,15 +381,16 @@ def get_user_tier(user_data: Optional[Dict[str, Any]]) -> str:
     return 'free'
 
 
-def count_speakers_in_text(text: str) -> int:
-    """Count unique speakers in text."""
-    if not text:
-        return 0
-    lines = text.strip().split('\n')
-    speakers = set()
-    for line in lines:
-        if ':' in line:
-            speaker_label = line.split(':', 1)[0].strip()
-            if speaker_label:
-                speakers.add(speaker_label)
-    return len(speakers)
\ No newline at end of file
+def get_cached_user_tier(db, uid: str) -> str:
+    """Determine user tier, reading only the tier flags on a cache miss."""
+    with _user_tier_cache_lock:
+        user_tier = _user_tier_cache.get(uid)
+    if user_tier is not None:
+        return user_tier
+    
+    user_doc = db.collection("users").document(uid).get(field_paths=["isPro", "isEnterprise"])
+    user_tier = get_user_tier(user_doc.to_dict() if user_doc.exists else {})
+    
+    with _user_tier_cache_lock:
+        _user_tier_cache[uid] = user_tier
+    return user_tier
\ No newline at end of file
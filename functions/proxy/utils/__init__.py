@@ -2,23 +2,31 @@
 """
 Shared utilities, constants, and helper functions for the voice cloning system.
 """
+import json
 import logging
 import sys
 import os
 import tempfile
-from typing import Optional, Dict, Any, List, Tuple
-from google.cloud import storage
+from types import MappingProxyType
+from typing import Optional, Dict, Any, List, Mapping, Tuple
+from flask import Request, Response
 import google.auth
 import google.auth.impersonated_credentials
 import google.auth.transport.requests
 
-# ✅ Configure logging for Cloud Functions immediately
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(levelname)s: [%(name)s] %(message)s',
-    stream=sys.stdout,
-    force=True
-)
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# ✅ Configure logging for Cloud Functions unless setup_cloud_logging (or an
+# earlier import) already did; forcing it would replace the existing handler
+if not logging.getLogger().handlers:
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(levelname)s: [%(name)s] %(message)s',
+        stream=sys.stdout
+    )
 
 logger = logging.getLogger(__name__)
 
@@ -27,7 +35,6 @@ logger.setLevel(logging.INFO)
 logger.propagate = True
 
 # Log module initialization
-print("utils/__init__.py loaded")
 logger.info("Utils module initialized")
 
 # API Constants
@@ -57,6 +64,23 @@ UPLOAD_LIMITS = {
     'enterprise': {'maxDurationSeconds': float('inf'), 'maxFileSizeMB': float('inf')}
 }
 
+# Browsers may reuse a preflight result for this long (Chrome caps it at 2h)
+CORS_PREFLIGHT_MAX_AGE_SECONDS = 3600
+
+# Response headers shared by every HTTP route (read-only so a handler
+# cannot corrupt them for later requests)
+CORS_HEADERS = MappingProxyType({
+    "Content-Type": "application/json",
+    "Access-Control-Allow-Origin": "*"
+})
+
+CORS_PREFLIGHT_HEADERS = MappingProxyType({
+    "Access-Control-Allow-Origin": "*",
+    "Access-Control-Allow-Methods": "POST, OPTIONS",
+    "Access-Control-Allow-Headers": "Authorization, Content-Type",
+    "Access-Control-Max-Age": str(CORS_PREFLIGHT_MAX_AGE_SECONDS),
+})
+
 # GCS Configuration
 GCS_RETRY_CONFIG = {
     'max_attempts': 3,
@@ -99,6 +123,7 @@ class GCSHelper:
         """Lazy-load storage client."""
         if self._client is None:
             logger.info("Creating GCS storage client...")
+            from google.cloud import storage
             self._client = storage.Client()
         return self._client
     
@@ -424,6 +449,33 @@ def sanitize_filename(filename: str) -> str:
     return filename
 
 
+def parse_json_body(req: Request) -> Any:
+    """
+    Parse a JSON request body with orjson (stdlib json if not installed).
+    
+    Returns None for an empty or malformed body, like get_json(silent=True).
+    """
+    body = req.get_data(cache=False)
+    if not body:
+        return None
+    try:
+        return orjson.loads(body) if orjson is not None else json.loads(body)
+    except ValueError:
+        return None
+
+
+def create_response(body: Any, status: int, headers: Mapping[str, str]) -> Response:
+    """Create a Flask Response object with headers."""
+    if isinstance(body, (dict, list)):
+        # orjson encodes straight to UTF-8 bytes; Content-Type comes from headers
+        body = orjson.dumps(body) if orjson is not None else json.dumps(body).encode()
+    
+    # Headers go through the constructor (as (key, value) pairs, which every
+    # werkzeug version accepts), so Content-Type replaces the default
+    # instead of being set header by header afterwards
+    return Response(body, status=status, headers=headers.items())
+
+
 # Export all utilities
 __all__ = [
     # Constants
@@ -440,6 +492,8 @@ __all__ = [
     'SPEAKER_LIMITS',
     'UPLOAD_LIMITS',
     'GCS_RETRY_CONFIG',
+    'CORS_HEADERS',
+    'CORS_PREFLIGHT_HEADERS',
     
     # Classes
     'GCSHelper',
@@ -452,4 +506,6 @@ __all__ = [
     'format_duration',
     'sanitize_filename',
     'get_impersonated_credentials',
+    'parse_json_body',
+    'create_response',
 ]
\ No newline at end of file
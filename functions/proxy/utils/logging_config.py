@@ -10,6 +10,10 @@ from typing import Optional
 # ✅ Global flag to prevent re-initialization
 _LOGGING_CONFIGURED = False
 
+# Name given to our root handler, so a re-imported module (which resets the
+# flag above) can still tell that logging is already set up
+_HANDLER_NAME = "cloud-functions-stdout"
+
 
 def setup_cloud_logging(level: int = logging.INFO, force: bool = False) -> None:
     """
@@ -23,16 +27,22 @@ def setup_cloud_logging(level: int = logging.INFO, force: bool = False) -> None:
     """
     global _LOGGING_CONFIGURED
     
-    if _LOGGING_CONFIGURED and not force:
+    root_logger = logging.getLogger()
+    
+    if not force and (
+        _LOGGING_CONFIGURED
+        or any(h.get_name() == _HANDLER_NAME for h in root_logger.handlers)
+    ):
+        _LOGGING_CONFIGURED = True
         return
     
     # ✅ Remove all existing handlers
-    root_logger = logging.getLogger()
     for handler in root_logger.handlers[:]:
         root_logger.removeHandler(handler)
     
     # ✅ Create new stdout handler with proper formatting
     handler = logging.StreamHandler(sys.stdout)
+    handler.set_name(_HANDLER_NAME)
     handler.setLevel(level)
     
     # Simple format for Cloud Logging (it adds its own metadata)
@@ -45,19 +55,7 @@ def setup_cloud_logging(level: int = logging.INFO, force: bool = False) -> None:
     root_logger.addHandler(handler)
     root_logger.setLevel(level)
     
-    # ✅ Force immediate flush
-    handler.flush()
-    sys.stdout.flush()
-    
     _LOGGING_CONFIGURED = True
-    
-    # Log successful configuration
-    print("=" * 80)
-    print("LOGGING CONFIGURED FOR CLOUD FUNCTIONS")
-    print(f"Level: {logging.getLevelName(level)}")
-    print(f"Handler: {handler.__class__.__name__} -> stdout")
-    print("=" * 80)
-    sys.stdout.flush()
 
 
 def get_logger(name: str, level: Optional[int] = None) -> logging.Logger:
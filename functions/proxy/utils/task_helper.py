@@ -4,11 +4,23 @@ Helper module for creating Cloud Tasks with standardized configuration.
 """
 import os
 import json
-import base64
 import logging
-from typing import Dict, Any, Optional, Tuple
-from google.cloud import tasks_v2
-from google.protobuf import duration_pb2
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Dict, Any, Iterable, Optional, Tuple, Union
+
+from google.api_core.exceptions import AlreadyExists
+from google.api_core.retry import Retry, if_transient_error
+
+if TYPE_CHECKING:
+    from google.cloud import tasks_v2
+    from google.protobuf import duration_pb2
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 logger = logging.getLogger(__name__)
 
@@ -24,25 +36,93 @@ QUEUE_LOCATION = os.environ.get("QUEUE_LOCATION", "us-central1")
 QUEUE_NAME = os.environ.get("QUEUE_NAME", "voice-generation-queue")
 SERVICE_ACCOUNT = os.environ.get("SERVICE_ACCOUNT_EMAIL")
 
-# Initialize Cloud Tasks client (singleton)
-_tasks_client: Optional[tasks_v2.CloudTasksClient] = None
+# Checked once per instance; create_cloud_task reports it instead of
+# re-validating the environment on every call
+_CONFIG_ERROR: Optional[str] = None
+if not CLOUD_RUN_URL or not INTERNAL_TOKEN:
+    _CONFIG_ERROR = "Cloud Run URL or Internal Token not configured"
+    logger.error(f"Cloud Tasks disabled: {_CONFIG_ERROR}")
+
+# Request parts shared by every task (tasks_v2 copies them into each message)
+_TASK_HEADERS = {
+    "Content-Type": "application/json",
+    "X-Internal-Token": INTERNAL_TOKEN,
+}
+
+# create_task deadline per attempt, so a stalled queue fails fast instead of
+# holding the caller open on the client default
+CREATE_TASK_TIMEOUT_SECONDS = 5.0
+
+# Retries are only safe for named tasks (a duplicate attempt is rejected
+# with AlreadyExists); unnamed tasks get a single attempt
+_NAMED_TASK_RETRY = Retry(
+    predicate=if_transient_error,
+    initial=0.1,
+    maximum=1.0,
+    multiplier=2.0,
+    deadline=10.0
+)
+
+# Max concurrent create_task calls in create_batch_tasks. The calls share
+# the client's single gRPC channel (multiplexed over one HTTP/2 connection),
+# so this only bounds how many RPCs are in flight at once
+BATCH_TASK_MAX_WORKERS = int(os.environ.get("BATCH_TASK_MAX_WORKERS", "16"))
+
+# Max create_task calls per second from this instance (token bucket, burst
+# of one second's worth), so large jobs are paced below the queue's
+# admission rate instead of being throttled and retried. 0 disables pacing
+ENQUEUE_MAX_PER_SECOND = float(os.environ.get("ENQUEUE_MAX_PER_SECOND", "100"))
+
+# Initialize Cloud Tasks client and batch executor lazily (singletons that
+# live for the warm instance, so the gRPC channel is reused across requests).
+# The tasks_v2 SDK itself is only imported on first use, keeping it off the
+# cold-start path of requests that never enqueue work.
+_tasks_client: Optional["tasks_v2.CloudTasksClient"] = None
+_task_oidc_token: Optional["tasks_v2.OidcToken"] = None
 _queue_path: Optional[str] = None
+_task_executor: Optional[ThreadPoolExecutor] = None
+_init_lock = threading.Lock()
+
+# Enqueue token bucket state (shared by every request on the instance)
+_pace_lock = threading.Lock()
+_pace_tokens = ENQUEUE_MAX_PER_SECOND
+_pace_updated = time.monotonic()
 
 
-def get_tasks_client() -> tasks_v2.CloudTasksClient:
+def get_tasks_client() -> "tasks_v2.CloudTasksClient":
     """Get or create Cloud Tasks client singleton."""
-    global _tasks_client, _queue_path
+    global _tasks_client, _task_oidc_token, _queue_path
     
     if _tasks_client is None:
-        client = tasks_v2.CloudTasksClient()
-        _tasks_client = client
-        _queue_path = client.queue_path(GCP_PROJECT, QUEUE_LOCATION, QUEUE_NAME)
-        logger.info(f"Initialized Cloud Tasks client for project: {GCP_PROJECT}")
-        return client
+        with _init_lock:
+            if _tasks_client is None:
+                from google.cloud import tasks_v2
+                
+                client = tasks_v2.CloudTasksClient()
+                _queue_path = client.queue_path(GCP_PROJECT, QUEUE_LOCATION, QUEUE_NAME)
+                if SERVICE_ACCOUNT:
+                    _task_oidc_token = tasks_v2.OidcToken(service_account_email=SERVICE_ACCOUNT)
+                _tasks_client = client
+                logger.info(f"Initialized Cloud Tasks client for project: {GCP_PROJECT}")
     
     return _tasks_client
 
 
+def get_task_executor() -> ThreadPoolExecutor:
+    """Get or create the thread pool used to create tasks concurrently."""
+    global _task_executor
+    
+    if _task_executor is None:
+        with _init_lock:
+            if _task_executor is None:
+                _task_executor = ThreadPoolExecutor(
+                    max_workers=BATCH_TASK_MAX_WORKERS,
+                    thread_name_prefix="cloud-tasks"
+                )
+    
+    return _task_executor
+
+
 def get_queue_path() -> str:
     """Get Cloud Tasks queue path."""
     get_tasks_client()  # Ensure initialization
@@ -51,11 +131,118 @@ def get_queue_path() -> str:
     return _queue_path
 
 
+def _pace_enqueue() -> None:
+    """Block until the enqueue token bucket allows another create_task call."""
+    global _pace_tokens, _pace_updated
+    
+    if ENQUEUE_MAX_PER_SECOND <= 0:
+        return
+    
+    with _pace_lock:
+        now = time.monotonic()
+        _pace_tokens = min(
+            ENQUEUE_MAX_PER_SECOND,
+            _pace_tokens + (now - _pace_updated) * ENQUEUE_MAX_PER_SECOND
+        )
+        _pace_updated = now
+        
+        if _pace_tokens >= 1:
+            _pace_tokens -= 1
+            return
+        
+        # Waiting under the lock keeps later callers queued behind this one;
+        # the token that accrues during the wait is spent by this call
+        wait = (1 - _pace_tokens) / ENQUEUE_MAX_PER_SECOND
+        time.sleep(wait)
+        _pace_tokens = 0.0
+        _pace_updated = now + wait
+
+
+def _encode_payload(task_payload: Dict[str, Any]) -> bytes:
+    """Encode a task payload as JSON bytes (orjson emits UTF-8 bytes directly)."""
+    if orjson is not None:
+        return orjson.dumps(task_payload)
+    return json.dumps(task_payload, separators=(",", ":")).encode()
+
+
+def encode_chunk_payloads(job_id: str, uid: str, chunk_ids: Iterable[int]) -> list[bytes]:
+    """
+    Encode {"job_id", "uid", "chunk_id"} payloads for the chunks of one job.
+    
+    The shared job_id/uid part is serialized once and each payload only
+    appends its chunk_id. The result can be passed to create_batch_tasks.
+    """
+    prefix = _encode_payload({"job_id": job_id, "uid": uid})[:-1] + b',"chunk_id":'
+    return [prefix + str(int(chunk_id)).encode() + b"}" for chunk_id in chunk_ids]
+
+
+def _build_task(
+    task_payload: Union[Dict[str, Any], bytes],
+    url: str,
+    dispatch_deadline: "duration_pb2.Duration",
+    task_id: Optional[str] = None
+) -> "tasks_v2.Task":
+    """Build a Cloud Task proto for an HTTP POST with the shared headers."""
+    from google.cloud import tasks_v2
+    
+    client = get_tasks_client()  # Also initializes the shared OIDC token
+    
+    # Pre-encoded payloads are sent as-is
+    payload_bytes = task_payload if isinstance(task_payload, bytes) else _encode_payload(task_payload)
+    
+    # Build HTTP request
+    http_request = tasks_v2.HttpRequest(
+        http_method=tasks_v2.HttpMethod.POST,
+        url=url,
+        headers=_TASK_HEADERS,
+        body=payload_bytes,
+    )
+    
+    # Add OIDC token if service account is configured
+    if _task_oidc_token is not None:
+        http_request.oidc_token = _task_oidc_token
+    
+    # Build task (retry_config is NOT supported per-task, only at queue level)
+    task = tasks_v2.Task(
+        http_request=http_request,
+        dispatch_deadline=dispatch_deadline,
+    )
+    
+    if task_id:
+        task.name = client.task_path(GCP_PROJECT, QUEUE_LOCATION, QUEUE_NAME, task_id)
+    
+    return task
+
+
+def _submit_task(task: "tasks_v2.Task", endpoint: str, task_id: Optional[str] = None) -> Tuple[bool, Optional[str]]:
+    """Send one create_task RPC, treating an already-queued named task as success."""
+    try:
+        _pace_enqueue()
+        response = get_tasks_client().create_task(
+            request={"parent": get_queue_path(), "task": task},
+            timeout=CREATE_TASK_TIMEOUT_SECONDS,
+            retry=_NAMED_TASK_RETRY if task_id else None
+        )
+        
+        logger.info(f"Task created: {response.name} -> {endpoint}")
+        return True, None
+        
+    except AlreadyExists:
+        logger.info(f"Task {task_id} already queued -> {endpoint}")
+        return True, None
+    
+    except Exception as e:
+        error_msg = f"Failed to create Cloud Task: {str(e)}"
+        logger.error(error_msg, exc_info=True)
+        return False, error_msg
+
+
 def create_cloud_task(
     task_payload: Dict[str, Any],
     endpoint: str = "/inference",
     dispatch_deadline_seconds: int = 900,
-    max_retry_attempts: int = 3
+    max_retry_attempts: int = 3,
+    task_id: Optional[str] = None
 ) -> Tuple[bool, Optional[str]]:
     """
     Create a Cloud Task with standardized configuration.
@@ -65,73 +252,51 @@ def create_cloud_task(
         endpoint: Cloud Run endpoint path (e.g., "/inference", "/extract-audio")
         dispatch_deadline_seconds: Maximum time for task execution
         max_retry_attempts: Maximum number of retry attempts (unused - configured at queue level)
+        task_id: Optional task name; Cloud Tasks rejects a second task with the
+            same name, so enqueuing the same work twice is treated as success
         
     Returns:
         Tuple of (success, error_message)
     """
-    if not CLOUD_RUN_URL or not INTERNAL_TOKEN:
-        error_msg = "Cloud Run URL or Internal Token not configured"
-        logger.error(error_msg)
-        return False, error_msg
+    if _CONFIG_ERROR:
+        return False, _CONFIG_ERROR
     
     try:
-        client = get_tasks_client()
-        queue_path = get_queue_path()
-        
-        # Encode the task payload
-        payload_bytes = json.dumps(task_payload).encode()
-        
-        # Build HTTP request
-        http_request = tasks_v2.HttpRequest(
-            http_method=tasks_v2.HttpMethod.POST,
-            url=f"{CLOUD_RUN_URL}{endpoint}",
-            headers={
-                "Content-Type": "application/json",
-                "X-Internal-Token": INTERNAL_TOKEN,
-            },
-            body=payload_bytes,
-        )
-        
-        # Add OIDC token if service account is configured
-        if SERVICE_ACCOUNT:
-            http_request.oidc_token = tasks_v2.OidcToken(
-                service_account_email=SERVICE_ACCOUNT
-            )
+        from google.protobuf import duration_pb2
         
-        # Create dispatch deadline duration
-        dispatch_deadline = duration_pb2.Duration()
-        dispatch_deadline.seconds = dispatch_deadline_seconds
-        
-        # Build task (retry_config is NOT supported per-task, only at queue level)
-        task = tasks_v2.Task(
-            http_request=http_request,
-            dispatch_deadline=dispatch_deadline,
-        )
-        
-        # Create the task
-        response = client.create_task(
-            request={"parent": queue_path, "task": task}
+        task = _build_task(
+            task_payload,
+            f"{CLOUD_RUN_URL}{endpoint}",
+            duration_pb2.Duration(seconds=dispatch_deadline_seconds),
+            task_id
         )
-        
-        logger.info(f"Task created: {response.name} -> {endpoint}")
-        return True, None
-        
     except Exception as e:
         error_msg = f"Failed to create Cloud Task: {str(e)}"
         logger.error(error_msg, exc_info=True)
         return False, error_msg
+    
+    return _submit_task(task, endpoint, task_id)
 
 
 def create_batch_tasks(
-    tasks: list[Dict[str, Any]],
-    endpoint: str = "/inference"
+    tasks: list[Union[Dict[str, Any], bytes]],
+    endpoint: str = "/inference",
+    task_ids: Optional[list[str]] = None,
+    dispatch_deadline_seconds: int = 900
 ) -> Tuple[int, int, list[str]]:
     """
     Create multiple Cloud Tasks in batch.
     
+    Cloud Tasks has no batch RPC, so all task protos are built up front and
+    only the create_task calls are fanned out on the shared (thread-safe)
+    client; the batch takes roughly as long as its slowest call.
+    
     Args:
-        tasks: List of task payloads
+        tasks: List of task payloads (dicts, or JSON bytes from
+            encode_chunk_payloads)
         endpoint: Cloud Run endpoint path
+        task_ids: Optional task names, one per payload (see create_cloud_task)
+        dispatch_deadline_seconds: Maximum time for each task's execution
         
     Returns:
         Tuple of (success_count, failure_count, error_messages)
@@ -140,9 +305,40 @@ def create_batch_tasks(
     failure_count = 0
     errors = []
     
-    for idx, task_payload in enumerate(tasks):
-        success, error = create_cloud_task(task_payload, endpoint)
+    if not tasks:
+        return success_count, failure_count, errors
+    
+    if _CONFIG_ERROR:
+        return 0, len(tasks), [f"Task {idx}: {_CONFIG_ERROR}" for idx in range(len(tasks))]
+    
+    if task_ids is None:
+        task_ids = [None] * len(tasks)
+    
+    try:
+        from google.protobuf import duration_pb2
         
+        url = f"{CLOUD_RUN_URL}{endpoint}"
+        dispatch_deadline = duration_pb2.Duration(seconds=dispatch_deadline_seconds)
+        built_tasks = [
+            _build_task(payload, url, dispatch_deadline, task_id)
+            for payload, task_id in zip(tasks, task_ids)
+        ]
+    except Exception as e:
+        error_msg = f"Failed to create Cloud Task: {str(e)}"
+        logger.error(error_msg, exc_info=True)
+        return 0, len(tasks), [f"Task {idx}: {error_msg}" for idx in range(len(tasks))]
+    
+    if len(built_tasks) == 1:
+        results = [_submit_task(built_tasks[0], endpoint, task_ids[0])]
+    else:
+        executor = get_task_executor()
+        results = list(executor.map(
+            lambda task, task_id: _submit_task(task, endpoint, task_id),
+            built_tasks,
+            task_ids
+        ))
+    
+    for idx, (success, error) in enumerate(results):
         if success:
             success_count += 1
         else:
@@ -0,0 +1,96 @@
+# functions/proxy/voice_job_queue.py
+"""
+Firestore-triggered Cloud Function that queues inference for new voice jobs.
+
+voice_clone only reserves credits, which creates the voiceJobs document in
+the same write; this trigger then enqueues the inference task(s). Task names
+are derived from the job ID, so a redelivered event cannot start a second
+GPU run.
+"""
+from firebase_functions import firestore_fn
+from typing import Optional
+import logging
+
+from firebase.db import get_db
+from firebase.credits import release_credits
+from google.cloud.firestore import SERVER_TIMESTAMP
+from utils.task_helper import create_cloud_task, create_batch_tasks, encode_chunk_payloads
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue_voice_job_tasks(job_id: str, uid: str, cost: int, chunk_count: Optional[int]) -> bool:
+    """
+    Queue the inference task(s) for a voice job.
+    On failure the job is marked failed and its credits are released.
+
+    Args:
+        job_id: Voice job ID
+        uid: Owner of the job
+        cost: Reserved credits to release on failure
+        chunk_count: Number of chunks for a chunked job, None for a single task
+
+    Returns:
+        True if every task was queued
+    """
+    try:
+        if chunk_count:
+            task_payloads = encode_chunk_payloads(job_id, uid, range(chunk_count))
+
+            _, failure_count, errors = create_batch_tasks(
+                task_payloads,
+                endpoint="/inference",
+                task_ids=[f"{job_id}-{i}" for i in range(chunk_count)]
+            )
+            if not failure_count:
+                logger.info(f"Job {job_id} queued successfully ({chunk_count} chunks)")
+                return True
+
+            logger.error(f"Failed to queue {failure_count} chunks for job {job_id}: {errors}")
+        else:
+            success, error = create_cloud_task(
+                {"job_id": job_id, "uid": uid},
+                endpoint="/inference",
+                task_id=job_id
+            )
+            if success:
+                logger.info(f"Job {job_id} queued successfully")
+                return True
+
+            logger.error(f"Failed to queue task for job {job_id}: {error}")
+    except Exception as e:
+        logger.error(f"Failed to queue job {job_id}: {str(e)}")
+
+    try:
+        get_db().collection("voiceJobs").document(job_id).update({
+            "status": "failed",
+            "error": "Failed to queue voice generation",
+            "updatedAt": SERVER_TIMESTAMP
+        })
+    except Exception as e:
+        logger.error(f"Failed to mark job {job_id} as failed: {str(e)}")
+    release_credits(uid, job_id, cost)
+    return False
+
+
+@firestore_fn.on_document_created(document="voiceJobs/{jobId}")
+def enqueue_voice_job(event: firestore_fn.Event[Optional[firestore_fn.DocumentSnapshot]]) -> None:
+    """Queue inference for a newly reserved voice job."""
+    snapshot = event.data
+    if snapshot is None:
+        return
+
+    job_id = event.params["jobId"]
+    job_data = snapshot.to_dict() or {}
+
+    # Only jobs created by a credit reservation are queued here
+    if job_data.get("status") != "queued" or not job_data.get("creditsReserved"):
+        logger.info(f"Skipping job {job_id}: not a newly reserved job")
+        return
+
+    enqueue_voice_job_tasks(
+        job_id,
+        job_data.get("uid"),
+        job_data.get("cost", 0),
+        job_data.get("totalChunks")
+    )